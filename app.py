@@ -1,16 +1,21 @@
 import os
 import secrets
+import uuid
 import csv
 import io
+import json
 import datetime
 import smtplib
+from concurrent.futures import ThreadPoolExecutor
 from email.message import EmailMessage
 from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, flash, session, make_response
+from flask import Flask, render_template, request, redirect, url_for, flash, session, Response, stream_with_context
 from werkzeug.utils import secure_filename
 from ocr_engine import OCREngine
 from grader import Grader
 from firebase_manager import FirebaseManager
+from batch_pipeline import BatchPipeline
+from job_queue import JobQueue
 
 import sys
 
@@ -31,7 +36,11 @@ sys.stderr.reconfigure(line_buffering=True)
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+RESULTS_PAGE_SIZE = int(os.environ.get("RESULTS_PAGE_SIZE", 50))
+RESULT_STATUSES = ['Graded', 'Pending Recorrection', 'Retest Requested']
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Keep a copy of every uploaded sheet on disk (written in the background, off the grading path)
+SAVE_UPLOADS = os.environ.get("SAVE_UPLOADS", "1") == "1"
 
 # Auth Config (Multi-Role Phase 3)
 # In production, these should be loaded securely from a database
@@ -49,11 +58,29 @@ print("Initializing AI Engines...")
 ocr_engine = OCREngine()
 grader_engine = Grader()
 firebase_mgr = FirebaseManager()
+upload_writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="upload-writer")
+
+def persist_upload(filename, data):
+    try:
+        with open(os.path.join(app.config['UPLOAD_FOLDER'], filename), 'wb') as f:
+            f.write(data)
+    except Exception as e:
+        print(f"Error saving upload {filename}: {e}")
 
 # Initialize Voice Manager
-from voice_manager import VoiceManager
+from voice_manager import VoiceManager, split_sentences
 voice_mgr = VoiceManager(output_dir="static/audio")
 
+batch_pipeline = BatchPipeline(ocr_engine, grader_engine, firebase_mgr, voice_mgr=voice_mgr)
+job_queue = JobQueue(batch_pipeline)
+
+def feedback_audio_url(result):
+    """The result's pre-rendered feedback audio, if it is still on disk (the audio cache may evict it)."""
+    audio_url = result.get('feedback_audio') if result else None
+    if audio_url and os.path.exists(audio_url.lstrip('/')):
+        return audio_url
+    return None
+
 @app.route('/voice_chat')
 def voice_chat():
     return render_template('voice_chat.html')
@@ -66,22 +93,12 @@ def api_chat():
     if not user_text:
         return {"error": "No text provided"}, 400
 
-    import requests
-    import json
-    
-    api_key = grader_engine.api_key
+    api_key = grader_engine.client.api_key
     model = grader_engine.model_name
     
     if not api_key:
         return {"error": "LLM API Key missing"}, 500
 
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "HTTP-Referer": os.environ.get("SITE_URL", "http://localhost"),
-        "X-Title": "AI Grader Chat",
-        "Content-Type": "application/json"
-    }
-
     system_prompt = "You are a helpful AI Assistant for an automated grading system. Answer questions concisely and naturally, as if speaking."
     
     payload = {
@@ -92,13 +109,13 @@ def api_chat():
         ]
     }
 
+    if data.get('stream'):
+        # Server-sent events: token deltas as they arrive, then each finished sentence with its audio
+        return Response(stream_with_context(stream_chat_events(payload)), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
     try:
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            data=json.dumps(payload),
-            timeout=30
-        )
+        response = grader_engine.client.chat_completion(payload, title="AI Grader Chat")
         
         if response.status_code == 200:
             ai_text = response.json()['choices'][0]['message']['content']
@@ -110,6 +127,74 @@ def api_chat():
     except Exception as e:
         return {"error": str(e)}, 500
 
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_chat_events(payload):
+    """
+    Relays an OpenRouter `stream: true` completion as server-sent events:
+    'delta' for each token chunk, 'sentence' (with a streaming audio URL) whenever a
+    sentence is complete, then 'done' with the full reply, or 'error'.
+    """
+    def sentence_event(sentence):
+        return sse_event('sentence', {"text": sentence, "audio_url": speech_url(sentence)})
+
+    try:
+        response = grader_engine.client.chat_completion(dict(payload, stream=True), title="AI Grader Chat", stream=True)
+    except Exception as e:
+        yield sse_event('error', {"error": str(e)})
+        return
+
+    with response:
+        if response.status_code != 200:
+            yield sse_event('error', {"error": f"LLM Error: {response.text}"})
+            return
+
+        # text/event-stream arrives without a charset, which requests would decode as ISO-8859-1
+        response.encoding = 'utf-8'
+        parts = []
+        pending = ''
+        for line in response.iter_lines(decode_unicode=True):
+            # Skip blank separators and ": OPENROUTER PROCESSING" keep-alive comments
+            if not line or not line.startswith('data:'):
+                continue
+            chunk = line[len('data:'):].strip()
+            if chunk == '[DONE]':
+                break
+            try:
+                delta = json.loads(chunk)['choices'][0].get('delta', {}).get('content') or ''
+            except (ValueError, KeyError, IndexError):
+                continue
+            if not delta:
+                continue
+
+            parts.append(delta)
+            yield sse_event('delta', {"text": delta})
+
+            pending += delta
+            sentences = split_sentences(pending)
+            # The last piece may still be growing
+            for sentence in sentences[:-1]:
+                yield sentence_event(sentence)
+            if len(sentences) > 1:
+                pending = sentences[-1]
+
+        if pending.strip():
+            yield sentence_event(pending.strip())
+        yield sse_event('done', {"text": ''.join(parts)})
+
+def speech_url(text):
+    """Cached audio for `text`, or a short streaming URL; the text itself never goes in the URL."""
+    return voice_mgr.cached_audio_url(text) or url_for('api_tts_stream', speech_id=voice_mgr.register_text(text))
+
+@app.route('/api/tts/<speech_id>')
+def api_tts_stream(speech_id):
+    """Streams speech for a registered text as chunked MP3, sentence by sentence."""
+    text = voice_mgr.registered_text(speech_id)
+    if text is None:
+        return {"error": "Unknown speech id"}, 404
+    return Response(stream_with_context(voice_mgr.stream_speech(text)), mimetype='audio/mpeg')
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -217,14 +302,10 @@ def student_portal():
                 flash(f"System Error: Database not connected. Details: {err_msg}", "error")
                 return render_template('student_search.html')
 
-            result = firebase_mgr.get_result_by_reg_no(reg_no)
+            doc_id, result = firebase_mgr.get_latest_result_with_id(reg_no)
             if result:
-                # Need to manually pass doc_id because get_result_by_reg_no might not include it dynamically in mock mode
-                # Let's search all results to find the exact doc_id
-                all_res = firebase_mgr.get_all_results()
-                doc_id = next((r.get('id') for r in all_res if r.get('register_number') == reg_no), None)
-                
-                return render_template('result.html', result=result, doc_id=doc_id, reg_no=reg_no)
+                return render_template('result.html', result=result, doc_id=doc_id, reg_no=reg_no,
+                                       feedback_audio=feedback_audio_url(result))
             else:
                 flash("No results found for this Register Number.", "error")
     
@@ -338,7 +419,8 @@ def staff_dashboard():
         last_doc_id = None
         last_roll = None
 
-        # 3. Process Execution
+        # 3. Read uploads into memory, then OCR/grade/save concurrently across papers
+        papers = []
         for task in tasks:
             ans_file = task['file']
             forced_roll = task['roll']
@@ -351,44 +433,39 @@ def staff_dashboard():
                     # Infer from filename
                     current_reg_no = os.path.splitext(ans_file.filename)[0]
                 
-                ans_filename = secure_filename(ans_file.filename)
-                ans_path = os.path.join(app.config['UPLOAD_FOLDER'], ans_filename)
-                ans_file.save(ans_path)
-                
-                print(f"Processing {ans_filename} for Student {current_reg_no}...")
-                
-                # OCR
-                processed_ans = ocr_engine.process_image(ans_path, "handwritten")
-                
-                # Grade
-                result = grader_engine.grade_answer(processed_ans, expected_ans_text)
-                
-                # Save
-                doc_id = firebase_mgr.save_result(
-                    student_answer=result.get('student_answer', ''),
-                    key_answer=result.get('key_answer', ''),
-                    score=result.get('similarity_score', 0),
-                    is_correct=result.get('is_correct', False),
-                    register_number=current_reg_no,
-                    image_path=ans_filename
-                )
-                
-                # To support the new fields in Firebase, let's explicitly add them if we can,
-                # or just know the result object has them for display.
-                # In order to not rewrite `save_result` signature, we can rely on `last_result` to hold it.
+                # Unique prefix so papers with the same name (or none left after sanitizing) don't overwrite each other
+                ans_filename = f"{uuid.uuid4().hex}_{secure_filename(ans_file.filename)}"
+                image_bytes = ans_file.read()
+                if SAVE_UPLOADS:
+                    upload_writer.submit(persist_upload, ans_filename, image_bytes)
+                papers.append({'reg_no': current_reg_no, 'image_bytes': image_bytes, 'filename': ans_filename, 'exam_id': exam_id})
                 
+            except Exception as e:
+                print(f"Error processing {ans_file.filename}: {e}")
+                error_count += 1
+                results_summary.append(f"❌ {ans_file.filename}: {str(e)}")
+
+        # Bulk uploads run in the background so the request returns straight away
+        if len(papers) > 1:
+            job_id = job_queue.submit(papers, expected_ans_text, exam_id=exam_id)
+            flash(f"Queued {len(papers)} papers for grading.", "success")
+            if error_count > 0:
+                flash(f"Failed to process {error_count} papers.", "error")
+            return redirect(url_for('job_status_page', job_id=job_id))
+
+        for outcome in batch_pipeline.run(papers, expected_ans_text):
+            if outcome['ok']:
+                result = outcome['result']
                 success_count += 1
-                results_summary.append(f"✅ {current_reg_no}: {result['similarity_score']}%")
+                results_summary.append(f"✅ {outcome['reg_no']}: {result['similarity_score']}%")
                 
                 # Store last for single-result redirect
                 last_result = result
-                last_doc_id = doc_id
-                last_roll = current_reg_no
-                
-            except Exception as e:
-                print(f"Error processing {ans_file.filename}: {e}")
+                last_doc_id = outcome['doc_id']
+                last_roll = outcome['reg_no']
+            else:
                 error_count += 1
-                results_summary.append(f"❌ {ans_file.filename}: {str(e)}")
+                results_summary.append(f"❌ {outcome['filename']}: {outcome['error']}")
         
         # Final Summary / Redirect
         if success_count > 0:
@@ -408,40 +485,116 @@ def staff_dashboard():
 
     return render_template('staff_dashboard.html', exams=exams)
 
+@app.route('/jobs/<job_id>')
+@login_required('faculty')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return {"error": "Job not found"}, 404
+    return job
+
+@app.route('/jobs/<job_id>/view')
+@login_required('faculty')
+def job_status_page(job_id):
+    return render_template('job_status.html', job_id=job_id)
+
 @app.route('/all_results')
 @login_required('faculty')
 def all_results():
     if not firebase_mgr.enabled:
         flash("Database disconnected. Cannot fetch results.", "error")
     
-    results = firebase_mgr.get_all_results()
-    return render_template('all_results.html', results=results)
-
-@app.route('/export_results_csv')
+    try:
+        page_size = max(1, min(int(request.args.get('limit', RESULTS_PAGE_SIZE)), 200))
+    except ValueError:
+        page_size = RESULTS_PAGE_SIZE
+    cursor = request.args.get('cursor') or None
+    exam_id = request.args.get('exam_id') or None
+    status = request.args.get('status') or None
+    # Cursors of the pages before this one, so "Previous" can walk back
+    trail = [c for c in request.args.get('trail', '').split(',') if c]
+
+    results, next_cursor = firebase_mgr.get_results_page(
+        limit=page_size, start_after=cursor, exam_id=exam_id, status=status
+    )
+    if results is None:
+        flash("Could not load results from the database. Please try again.", "error")
+        results = []
+
+    filters = {'limit': page_size}
+    if exam_id:
+        filters['exam_id'] = exam_id
+    if status:
+        filters['status'] = status
+
+    next_url = None
+    if next_cursor:
+        next_trail = trail + [cursor] if cursor else trail
+        next_url = url_for('all_results', cursor=next_cursor, trail=','.join(next_trail) or None, **filters)
+    prev_url = None
+    if cursor:
+        prev_url = url_for('all_results', cursor=trail[-1] if trail else None,
+                           trail=','.join(trail[:-1]) or None, **filters)
+
+    return render_template('all_results.html',
+                           results=results,
+                           exams=firebase_mgr.get_all_exams(),
+                           selected_exam=exam_id,
+                           selected_status=status,
+                           statuses=RESULT_STATUSES,
+                           page_size=page_size,
+                           page_number=len(trail) + (2 if cursor else 1),
+                           next_url=next_url,
+                           prev_url=prev_url)
+
+@app.route('/result/<doc_id>')
 @login_required('faculty')
-def export_results_csv():
-    results = firebase_mgr.get_all_results()
-    
+def view_result(doc_id):
+    result = firebase_mgr.get_result(doc_id)
+    if not result:
+        flash("Result not found.", "error")
+        return redirect(url_for('all_results'))
+    return render_template('result.html', result=result, doc_id=doc_id,
+                           reg_no=result.get('register_number'), is_staff=True,
+                           feedback_audio=feedback_audio_url(result))
+
+# Only the columns the CSV needs are read, so large answer text never leaves the database
+CSV_FIELDS = ['register_number', 'score', 'is_correct', 'timestamp']
+
+def iter_results_csv():
+    """Yields the results CSV one line at a time."""
     si = io.StringIO()
     cw = csv.writer(si)
+
+    def flush():
+        line = si.getvalue()
+        si.seek(0)
+        si.truncate(0)
+        return line
+
     cw.writerow(['Register Number', 'Score', 'Status', 'Timestamp'])
-    
-    for r in results:
+    yield flush()
+
+    for r in firebase_mgr.iter_results(CSV_FIELDS):
         status = "Correct" if r.get('is_correct') else "Incorrect"
-        timestamp = r.get('timestamp', '')
-        if isinstance(timestamp, datetime.datetime):
-             # Make it timezone naive or just format it
-             timestamp = timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        elif hasattr(timestamp, 'strftime'):
+        timestamp = r.get('timestamp') or ''
+        if isinstance(timestamp, str):
+             # The SQLite store hands timestamps back as ISO strings
+             try:
+                 timestamp = datetime.datetime.fromisoformat(timestamp)
+             except ValueError:
+                 pass
+        if hasattr(timestamp, 'strftime'):
              timestamp = timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        cw.writerow([r.get('register_number', 'N/A'), f"{r.get('score', 0)}%", status, timestamp])
-        
-    output = si.getvalue()
-    si.close()
-    
-    response = make_response(output)
+        cw.writerow([r.get('register_number') or 'N/A', f"{r.get('score') or 0}%", status, timestamp])
+        yield flush()
+
+@app.route('/export_results_csv')
+@login_required('faculty')
+def export_results_csv():
+    # Streamed so memory stays flat however many results there are
+    response = Response(stream_with_context(iter_results_csv()), mimetype='text/csv')
     response.headers["Content-Disposition"] = "attachment; filename=all_students_results.csv"
-    response.headers["Content-type"] = "text/csv"
     return response
 
 @app.route('/email_results', methods=['POST'])
@@ -452,18 +605,7 @@ def email_results():
          flash("Email address is required.", "error")
          return redirect(url_for('all_results'))
          
-    results = firebase_mgr.get_all_results()
-    si = io.StringIO()
-    cw = csv.writer(si)
-    cw.writerow(['Register Number', 'Score', 'Status', 'Timestamp'])
-    for r in results:
-        status = "Correct" if r.get('is_correct') else "Incorrect"
-        timestamp = r.get('timestamp', '')
-        if isinstance(timestamp, datetime.datetime) or hasattr(timestamp, 'strftime'):
-             timestamp = timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        cw.writerow([r.get('register_number', 'N/A'), f"{r.get('score', 0)}%", status, timestamp])
-    csv_content = si.getvalue()
-    si.close()
+    csv_content = ''.join(iter_results_csv())
 
     smtp_server = os.environ.get("SMTP_SERVER", "smtp.gmail.com")
     smtp_port = int(os.environ.get("SMTP_PORT", 587))
@@ -497,20 +639,42 @@ def email_results():
 @app.route('/admin')
 @login_required('admin')
 def admin_dashboard():
-    # Fetch high-level statistics
-    results = firebase_mgr.get_all_results() if firebase_mgr.enabled else []
-    total_submissions = len(results)
-    
-    # Calculate some basic metrics
-    passed = sum(1 for r in results if r.get('is_correct'))
-    failed = total_submissions - passed
-    avg_score = sum(float(r.get('score', 0)) for r in results) / total_submissions if total_submissions > 0 else 0
+    # Read the incrementally maintained counters instead of scanning every result
+    stats = firebase_mgr.get_stats()
+    exam_stats = firebase_mgr.get_exam_stats()
+    exam_names = {e['id']: e.get('course_name', e['id']) for e in firebase_mgr.get_all_exams()}
+    exam_breakdown = [
+        {'name': exam_names.get(exam_id, exam_id), 'avg_score': round(s['avg_score'], 1), **{k: s[k] for k in ('total', 'passed', 'failed')}}
+        for exam_id, s in exam_stats.items()
+    ]
+    exam_breakdown.sort(key=lambda e: e['name'])
     
     return render_template('admin_dashboard.html', 
-                           total_submissions=total_submissions,
-                           passed=passed,
-                           failed=failed,
-                           avg_score=round(avg_score, 1))
+                           total_submissions=stats['total'],
+                           passed=stats['passed'],
+                           failed=stats['failed'],
+                           avg_score=round(stats['avg_score'], 1),
+                           exam_breakdown=exam_breakdown)
+
+@app.route('/admin/recompute_stats', methods=['POST'])
+@login_required('admin')
+def recompute_stats():
+    if firebase_mgr.recompute_stats() is None:
+        flash("Could not recompute statistics. Please try again.", "error")
+    else:
+        flash("Statistics recomputed from all results.", "success")
+    return redirect(url_for('admin_dashboard'))
+
+@app.route('/admin/cache_stats')
+@login_required('admin')
+def cache_stats():
+    """Hit/miss counters for this worker's caches."""
+    return {
+        "grading": grader_engine.stats(),
+        "ocr": ocr_engine.cache.stats(),
+        "exams": firebase_mgr.exam_cache.stats(),
+        "tts": voice_mgr.stats()
+    }
 
 @app.route('/settings')
 @login_required() # Any logged in user
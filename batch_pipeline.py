@@ -0,0 +1,240 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ocr_engine import OCRFailure
+from openrouter_client import RetryBudget, use_retry_budget
+from result_writer import BufferedResultWriter
+
+class BatchPipeline:
+    """
+    Runs OCR -> grade -> save for a batch of answer sheets with bounded concurrency.
+    Each paper is isolated: a failure is recorded in its outcome and never aborts the batch.
+    """
+    def __init__(self, ocr_engine, grader_engine, firebase_mgr, max_workers=None, batched_grading=None, bulk_writes=None,
+                 voice_mgr=None, feedback_audio=None):
+        self.ocr_engine = ocr_engine
+        self.grader_engine = grader_engine
+        self.firebase_mgr = firebase_mgr
+        self.voice_mgr = voice_mgr
+        self.max_workers = int(max_workers or os.environ.get("BATCH_WORKERS", 4))
+        if batched_grading is None:
+            batched_grading = os.environ.get("BATCH_GRADING", "0") == "1"
+        # When set, answers are graded through Grader.grade_batch after OCR instead of one call per paper
+        self.batched_grading = batched_grading
+        if bulk_writes is None:
+            bulk_writes = os.environ.get("BULK_WRITES", "1") == "1"
+        # When set, results are committed in batches by a BufferedResultWriter instead of one write per paper
+        self.bulk_writes = bulk_writes
+        if feedback_audio is None:
+            feedback_audio = os.environ.get("FEEDBACK_AUDIO", "0") == "1"
+        # When set, each saved result's feedback is synthesized to speech in the background
+        self.feedback_audio = feedback_audio and voice_mgr is not None
+        self._audio_recorder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="feedback-audio") if self.feedback_audio else None
+
+    def _retry_budget(self, paper_count):
+        # Shared by every paper in the batch so a provider outage cannot retry forever
+        return RetryBudget(int(os.environ.get("BATCH_RETRY_BUDGET") or max(10, 2 * paper_count)))
+
+    @staticmethod
+    def _check_ocr(text):
+        if isinstance(text, OCRFailure):
+            raise RuntimeError(str(text))
+        return text
+
+    @staticmethod
+    def _check_grade(result):
+        # A failed LLM call must not be stored as a genuine 0% score
+        if result.get('error'):
+            raise RuntimeError(f"Grading failed: {result['error']}")
+        return result
+
+    @staticmethod
+    def _image(paper):
+        image = paper.get('image_bytes')
+        return image if image is not None else paper['image_path']
+
+    def _save_kwargs(self, paper, result):
+        return {
+            'student_answer': result.get('student_answer', ''),
+            'key_answer': result.get('key_answer', ''),
+            'score': result.get('similarity_score', 0),
+            'is_correct': result.get('is_correct', False),
+            'register_number': paper['reg_no'],
+            'image_path': paper['filename'],
+            'exam_id': paper.get('exam_id'),
+            'reasoning': result.get('reasoning')
+        }
+
+    def _save(self, paper, result):
+        return self.firebase_mgr.save_result(**self._save_kwargs(paper, result))
+
+    @staticmethod
+    def _success(paper, result, doc_id):
+        return {'ok': True, 'reg_no': paper['reg_no'], 'filename': paper['filename'], 'result': result, 'doc_id': doc_id}
+
+    @staticmethod
+    def _failure(paper, e):
+        print(f"Error processing {paper['filename']}: {e}")
+        return {'ok': False, 'reg_no': paper['reg_no'], 'filename': paper['filename'], 'error': str(e)}
+
+    def _queue_feedback_audio(self, outcome):
+        """Synthesizes a saved result's feedback on the voice loop and records the audio URL on the result."""
+        feedback = outcome['result'].get('reasoning')
+        if not feedback or not outcome.get('doc_id'):
+            return
+
+        def rendered(future):
+            # Runs on the voice loop; the database write happens on the recorder thread instead
+            try:
+                audio_url = future.result()
+            except Exception as e:
+                print(f"Feedback audio failed for {outcome['filename']}: {e}")
+                return
+            self._audio_recorder.submit(self.firebase_mgr.set_feedback_audio, outcome['doc_id'], audio_url)
+
+        self.voice_mgr.submit(feedback).add_done_callback(rendered)
+
+    def _grade(self, paper, key_text):
+        print(f"Processing {paper['filename']} for Student {paper['reg_no']}...")
+
+        # OCR
+        processed_ans = self._check_ocr(self.ocr_engine.process_image(self._image(paper), "handwritten"))
+
+        # Grade
+        return self._check_grade(self.grader_engine.grade_answer(processed_ans, key_text))
+
+    def process_paper(self, paper, key_text):
+        """
+        Grades a single paper. `paper` is a dict with 'reg_no', 'filename' and either
+        'image_bytes' (in-memory upload) or 'image_path'.
+        Returns an outcome dict; 'ok' tells whether the paper went through every stage.
+        """
+        try:
+            result = self._grade(paper, key_text)
+
+            # Save
+            doc_id = self._save(paper, result)
+
+            return self._success(paper, result, doc_id)
+        except Exception as e:
+            return self._failure(paper, e)
+
+    def run(self, papers, key_text, on_result=None, on_start=None):
+        """
+        Processes `papers` concurrently and returns their outcomes in submission order.
+        `on_start(index)` is called when a worker picks a paper up and
+        `on_result(index, outcome)` as each paper finishes, in completion order.
+        With bulk writes on, results are saved through a BufferedResultWriter and a
+        paper only counts as finished once its write has been committed.
+        """
+        outcomes = [None] * len(papers)
+        if not papers:
+            return outcomes
+
+        budget = self._retry_budget(len(papers))
+        writer = BufferedResultWriter(self.firebase_mgr) if self.bulk_writes else None
+        lock = threading.Lock()
+
+        def finish(i, outcome):
+            with lock:
+                outcomes[i] = outcome
+                if on_result:
+                    on_result(i, outcome)
+            if self.feedback_audio and outcome['ok']:
+                self._queue_feedback_audio(outcome)
+
+        def store(i, result):
+            paper = papers[i]
+            if writer is None:
+                try:
+                    finish(i, self._success(paper, result, self._save(paper, result)))
+                except Exception as e:
+                    finish(i, self._failure(paper, e))
+                return
+
+            def saved(save_future):
+                try:
+                    finish(i, self._success(paper, result, save_future.result()))
+                except Exception as e:
+                    finish(i, self._failure(paper, e))
+
+            writer.submit(**self._save_kwargs(paper, result)).add_done_callback(saved)
+
+        try:
+            if self.batched_grading and len(papers) > 1:
+                self._run_batched(papers, key_text, budget, on_start, finish, store)
+            else:
+                self._run_concurrent(papers, key_text, budget, on_start, finish, store, writer)
+        finally:
+            if writer:
+                writer.close()
+
+        return outcomes
+
+    def _run_concurrent(self, papers, key_text, budget, on_start, finish, store, writer):
+        """One worker per paper runs OCR and grading (and the save, when not buffering writes)."""
+        def work(i, paper):
+            if on_start:
+                on_start(i)
+            with use_retry_budget(budget):
+                if writer is None:
+                    return self.process_paper(paper, key_text)
+                return self._grade(paper, key_text)
+
+        workers = max(1, min(self.max_workers, len(papers)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(work, i, paper): i
+                for i, paper in enumerate(papers)
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                if writer is None:
+                    finish(i, future.result())
+                    continue
+                try:
+                    result = future.result()
+                except Exception as e:
+                    finish(i, self._failure(papers[i], e))
+                    continue
+                store(i, result)
+
+    def _run_batched(self, papers, key_text, budget, on_start, finish, store):
+        """
+        OCRs every paper concurrently, then grades the transcripts with grade_batch
+        (one request per chunk of answers) and saves each result.
+        """
+        def ocr(i, paper):
+            if on_start:
+                on_start(i)
+            print(f"Processing {paper['filename']} for Student {paper['reg_no']}...")
+            with use_retry_budget(budget):
+                return self._check_ocr(self.ocr_engine.process_image(self._image(paper), "handwritten"))
+
+        transcripts = {}
+        workers = max(1, min(self.max_workers, len(papers)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(ocr, i, paper): i for i, paper in enumerate(papers)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    transcripts[i] = future.result()
+                except Exception as e:
+                    finish(i, self._failure(papers[i], e))
+
+        indexes = sorted(transcripts)
+        try:
+            with use_retry_budget(budget):
+                results = self.grader_engine.grade_batch([transcripts[i] for i in indexes], key_text)
+        except Exception as e:
+            for i in indexes:
+                finish(i, self._failure(papers[i], e))
+            return
+
+        for i, result in zip(indexes, results):
+            try:
+                self._check_grade(result)
+            except Exception as e:
+                finish(i, self._failure(papers[i], e))
+                continue
+            store(i, result)
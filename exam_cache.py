@@ -0,0 +1,82 @@
+import os
+import time
+import copy
+import threading
+
+class ExamCache:
+    """
+    In-process TTL cache for exam data (the exam list and answer keys), which only changes
+    when an exam is created. `invalidate()` clears it immediately.
+
+    With `version_file` set, invalidation also reaches other gunicorn workers: it touches the
+    file, and every worker drops its entries once it sees the file's mtime change.
+    """
+    def __init__(self, ttl=None, version_file=None):
+        self.ttl = float(ttl if ttl is not None else os.environ.get("EXAM_CACHE_TTL", 300))
+        if version_file is None:
+            version_file = os.environ.get("EXAM_CACHE_VERSION_FILE", "exam_cache.version")
+        self.version_file = version_file or None
+        self._entries = {}
+        self._version = self._read_version()
+        # Bumped by every invalidate() in this process; covers loads that race it even without a version file
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _read_version(self):
+        if not self.version_file:
+            return None
+        try:
+            return os.stat(self.version_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def get_or_load(self, key, loader):
+        """
+        Returns a copy of the cached value for `key`, calling `loader()` on a miss or expiry.
+        A None result from the loader (not found, or a failed read) is returned but not cached.
+        """
+        now = time.monotonic()
+        version = self._read_version()
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            generation = self._generation
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+
+        value = loader()
+        if value is not None and self.ttl > 0:
+            with self._lock:
+                # Skip the store if an invalidation happened while we were loading
+                if self._version == version and self._generation == generation:
+                    self._entries[key] = (now + self.ttl, copy.deepcopy(value))
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            if self.version_file:
+                try:
+                    with open(self.version_file, "a"):
+                        pass
+                    os.utime(self.version_file, None)
+                except OSError as e:
+                    print(f"Exam cache invalidation error: {e}")
+                self._version = self._read_version()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entries": len(self._entries)
+            }
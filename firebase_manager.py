@@ -3,21 +3,156 @@ from firebase_admin import credentials, firestore
 import os
 import datetime
 import json
+import mmap
 import uuid
+import hashlib
+import random
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; LocalDB then only guards against other threads
+    fcntl = None
+from sqlite_db import SQLiteLocalDB
+from exam_cache import ExamCache
+
+def _json_default(obj):
+    # Convert datetime objects to string for JSON serialization
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return obj.isoformat()
+    return str(obj)
+
+def _sort_value(value):
+    # Fresh documents hold datetimes while reloaded ones hold ISO strings; compare both as ISO text
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value if value is not None else '')
+
+def _timestamp_value(value):
+    # Firestore hands back timezone-aware UTC datetimes for the naive ones we store
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return _sort_value(value)
+
+# Large text fields that LocalDB's blob mode keeps on disk instead of in memory
+BLOB_FIELDS = ("student_answer", "key_answer", "answer_key")
+
+def _blob_ref(value):
+    # Blob-mode documents hold {"$blob": [offset, length]} in place of the text
+    if isinstance(value, dict) and "$blob" in value:
+        return value["$blob"]
+    return None
 
 class LocalDB:
     """
     A simple JSON-based mock database for local development when Firebase is not configured.
+
+    In journal mode (the default) writes are appended to `<db_file>.log` as one JSON line each,
+    so an insert costs the same however large the DB is. `load()` replays the log on top of
+    the last snapshot, and the log is folded back into the snapshot in the background once it
+    passes `compact_bytes`.
+
+    Several processes (e.g. gunicorn workers) can share one store: writes hold an exclusive
+    `fcntl` lock on `<db_file>.lock`, and before every operation the in-memory copy catches up
+    by replaying only the journal lines other processes appended since it last looked.
+
+    In blob mode the BLOB_FIELDS texts are appended to `<db_file>.blobs` and documents keep
+    only a reference, so memory holds just the small fields. The texts are read back through
+    a memory map when a single document is fetched; list views (`page`) leave them out.
     """
-    def __init__(self, db_file="local_db.json"):
+    def __init__(self, db_file="local_db.json", journal=None, compact_bytes=None, blobs=None):
         self.db_file = db_file
+        self.log_file = f"{db_file}.log"
+        # Log being folded into the snapshot by a running (or interrupted) compaction
+        self.compacting_file = f"{db_file}.log.compacting"
+        self.lock_file = f"{db_file}.lock"
+        self.blob_file = f"{db_file}.blobs"
+        if blobs is None:
+            blobs = os.environ.get("LOCAL_DB_BLOBS", "0") == "1"
+        self.blobs = blobs
+        self._blob_map = None
+        # Recently stored texts by hash, so the answer key repeated on every paper is stored once
+        self._recent_blobs = OrderedDict()
+        if journal is None:
+            journal = os.environ.get("LOCAL_DB_JOURNAL", "1") == "1"
+        self.journal = journal
+        self.compact_bytes = int(compact_bytes or os.environ.get("LOCAL_DB_COMPACT_BYTES", 5 * 1024 * 1024))
+        self._compacting = False
+        # Guards self.data; batch grading saves results from several threads at once
+        self.lock = threading.RLock()
+        self._lock_fd = None
+        self._lock_pid = None
+        self._lock_depth = 0
+        # What this process has already applied: the snapshot it loaded and how far into the log it read
+        self._snapshot_stamp = False
+        self._log_id = None
+        self._log_pos = 0
         self.data = {
             "graded_papers": {},
             "exams": {}
         }
-        self.load()
+        with self._locked(exclusive=False):
+            pass
+
+    @staticmethod
+    def _file_stamp(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _process_lock_fd(self):
+        if fcntl is None:
+            return None
+        # flock locks belong to the open file, so a forked worker needs its own descriptor
+        if self._lock_fd is None or self._lock_pid != os.getpid():
+            self._lock_fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+            self._lock_pid = os.getpid()
+        return self._lock_fd
+
+    @contextmanager
+    def _locked(self, exclusive=True):
+        """Holds the thread lock and the cross-process file lock, with self.data brought up to date."""
+        with self.lock:
+            fd = self._process_lock_fd() if self._lock_depth == 0 else None
+            if fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._lock_depth += 1
+            try:
+                if self._lock_depth == 1:
+                    self._sync()
+                yield
+            finally:
+                self._lock_depth -= 1
+                if fd is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _sync(self):
+        """Applies changes other processes made since the last sync (caller holds the locks)."""
+        try:
+            log_stat = os.stat(self.log_file)
+        except OSError:
+            log_stat = None
+        log_id = (log_stat.st_dev, log_stat.st_ino) if log_stat else None
+
+        rotated = (log_stat is None and self._log_pos > 0) or \
+                  (log_id is not None and self._log_id is not None and log_id != self._log_id)
+        if rotated or self._file_stamp(self.db_file) != self._snapshot_stamp:
+            # Another process compacted or rewrote the snapshot; start over from the files
+            self.load()
+        elif log_stat is not None and log_stat.st_size > self._log_pos:
+            self._log_pos = self._replay(self.log_file, self._log_pos)
+            self._log_id = log_id
 
     def load(self):
+        self.data = {
+            "graded_papers": {},
+            "exams": {}
+        }
+        self._snapshot_stamp = self._file_stamp(self.db_file)
         if os.path.exists(self.db_file):
             try:
                 with open(self.db_file, 'r') as f:
@@ -25,60 +160,402 @@ class LocalDB:
                     if content:
                         loaded = json.loads(content)
                         # Ensure structure
-                        self.data["graded_papers"] = loaded.get("graded_papers", {})
-                        self.data["exams"] = loaded.get("exams", {})
+                        for collection, docs in loaded.items():
+                            self.data[collection] = docs
             except Exception as e:
                 print(f"Error loading local DB: {e}")
 
+        if os.path.exists(self.compacting_file):
+            self._replay(self.compacting_file)
+        self._log_pos = 0
+        self._log_id = None
+        if os.path.exists(self.log_file):
+            st = os.stat(self.log_file)
+            self._log_id = (st.st_dev, st.st_ino)
+            self._log_pos = self._replay(self.log_file)
+
+    def _replay(self, path, offset=0):
+        """Applies every complete journal line after `offset` and returns the offset reached."""
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            chunk = f.read()
+        # A line without its newline is still being written (or was torn by a crash); leave it
+        complete = chunk[:chunk.rfind(b"\n") + 1]
+        for line in complete.decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            try:
+                self._apply(json.loads(line))
+            except Exception as e:
+                # A torn line from a crash mid-append is expected; skip it
+                print(f"Skipping bad journal entry in {path}: {e}")
+        return offset + len(complete)
+
+    def _apply(self, entry):
+        docs = self.data.setdefault(entry["c"], {})
+        if entry["op"] == "put":
+            docs[entry["id"]] = entry["doc"]
+        elif entry["op"] == "update" and entry["id"] in docs:
+            docs[entry["id"]].update(entry["fields"])
+        elif entry["op"] == "inc":
+            counters = docs.setdefault(entry["id"], {})
+            for field, delta in entry["fields"].items():
+                counters[field] = counters.get(field, 0) + delta
+        elif entry["op"] == "delete":
+            docs.pop(entry["id"], None)
+
     def save(self):
+        """Writes a full snapshot of the DB (used directly when journaling is off)."""
         try:
-            # Convert datetime objects to string for JSON serialization
-            # This is a simple serialization; for production use proper serializers
-            def default_serializer(obj):
-                if isinstance(obj, (datetime.date, datetime.datetime)):
-                    return obj.isoformat()
-                return str(obj)
-
-            with open(self.db_file, 'w') as f:
-                json.dump(self.data, f, indent=4, default=default_serializer)
+            with self._locked():
+                tmp_file = f"{self.db_file}.{os.getpid()}.tmp"
+                with open(tmp_file, 'w') as f:
+                    json.dump(self.data, f, indent=4, default=_json_default)
+                os.replace(tmp_file, self.db_file)
+                self._snapshot_stamp = self._file_stamp(self.db_file)
         except Exception as e:
             print(f"Error saving local DB: {e}")
 
+    def _write(self, *entries):
+        # Caller must hold self._locked()
+        if not self.journal:
+            self.save()
+            return
+        try:
+            with open(self.log_file, 'ab') as f:
+                f.write("".join(json.dumps(entry, default=_json_default) + "\n" for entry in entries).encode('utf-8'))
+                size = f.tell()
+                st = os.fstat(f.fileno())
+            # Everything up to here is already in memory (we synced under the lock before writing)
+            self._log_pos = size
+            self._log_id = (st.st_dev, st.st_ino)
+        except Exception as e:
+            print(f"Error writing local DB journal: {e}")
+            return
+        if size >= self.compact_bytes and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    def compact(self):
+        """Folds the journal into a fresh snapshot without blocking writers for the disk I/O."""
+        compact_fd = None
+        try:
+            if fcntl is not None:
+                # Only one process compacts at a time; the others simply skip
+                compact_fd = os.open(f"{self.lock_file}.compact", os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(compact_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return
+
+            with self._locked():
+                snapshot = json.dumps(self.data, default=_json_default)
+                if os.path.exists(self.log_file):
+                    if os.path.exists(self.compacting_file):
+                        # Left over from an interrupted compaction; keep its entries until the snapshot lands
+                        with open(self.log_file, 'r') as src, open(self.compacting_file, 'a') as dst:
+                            dst.write(src.read())
+                        os.remove(self.log_file)
+                    else:
+                        os.replace(self.log_file, self.compacting_file)
+                self._log_pos = 0
+                self._log_id = None
+
+            tmp_file = f"{self.db_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w') as f:
+                f.write(snapshot)
+
+            with self._locked():
+                os.replace(tmp_file, self.db_file)
+                if os.path.exists(self.compacting_file):
+                    os.remove(self.compacting_file)
+                self._snapshot_stamp = self._file_stamp(self.db_file)
+        except Exception as e:
+            print(f"Error compacting local DB: {e}")
+        finally:
+            if compact_fd is not None:
+                os.close(compact_fd)
+            self._compacting = False
+
+    def _store_blob(self, text):
+        # Caller must hold self._locked()
+        raw = text.encode('utf-8')
+        digest = hashlib.sha256(raw).digest()
+        ref = self._recent_blobs.get(digest)
+        if ref is not None:
+            self._recent_blobs.move_to_end(digest)
+            return ref
+        with open(self.blob_file, 'ab') as f:
+            offset = f.tell()
+            f.write(raw)
+        ref = [offset, len(raw)]
+        self._recent_blobs[digest] = ref
+        if len(self._recent_blobs) > 256:
+            self._recent_blobs.popitem(last=False)
+        return ref
+
+    def _externalize(self, data):
+        """Returns `data` with long text fields moved to the blob file (blob mode only)."""
+        if not self.blobs or not any(isinstance(data.get(f), str) for f in BLOB_FIELDS):
+            return data
+        stored = dict(data)
+        for field in BLOB_FIELDS:
+            if isinstance(stored.get(field), str):
+                stored[field] = {"$blob": self._store_blob(stored[field])}
+        return stored
+
+    def _blob_text(self, ref):
+        offset, length = ref
+        with self.lock:
+            if self._blob_map is None or offset + length > len(self._blob_map):
+                # The file has grown since it was mapped (or was never mapped)
+                if self._blob_map is not None:
+                    self._blob_map.close()
+                with open(self.blob_file, 'rb') as f:
+                    self._blob_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._blob_map[offset:offset + length].decode('utf-8')
+
+    def _resolve(self, data, fields=BLOB_FIELDS):
+        """Copy of `data` with any blob references among `fields` replaced by their text."""
+        res = data.copy()
+        for field in fields:
+            ref = _blob_ref(res.get(field))
+            if ref is not None:
+                res[field] = self._blob_text(ref)
+        return res
+
     def add_document(self, collection, data):
         doc_id = str(uuid.uuid4())
         if "timestamp" not in data and "created_at" not in data:
              data["timestamp"] = datetime.datetime.now().isoformat()
         
-        self.data[collection][doc_id] = data
-        self.save()
+        with self._locked():
+            data = self._externalize(data)
+            self.data.setdefault(collection, {})[doc_id] = data
+            self._write({"op": "put", "c": collection, "id": doc_id, "doc": data})
         return doc_id
 
+    def add_documents(self, collection, docs):
+        """Inserts several documents with a single journal append."""
+        doc_ids = []
+        now = datetime.datetime.now().isoformat()
+        for data in docs:
+            if "timestamp" not in data and "created_at" not in data:
+                data["timestamp"] = now
+            doc_ids.append(str(uuid.uuid4()))
+
+        with self._locked():
+            target = self.data.setdefault(collection, {})
+            entries = []
+            for doc_id, data in zip(doc_ids, docs):
+                data = self._externalize(data)
+                target[doc_id] = data
+                entries.append({"op": "put", "c": collection, "id": doc_id, "doc": data})
+            self._write(*entries)
+        return doc_ids
+
+    def set_document(self, collection, doc_id, data):
+        """Creates or overwrites a document under a caller-chosen id."""
+        with self._locked():
+            data = self._externalize(data)
+            self.data.setdefault(collection, {})[doc_id] = data
+            self._write({"op": "put", "c": collection, "id": doc_id, "doc": data})
+        return doc_id
+
+    def set_document_if_newer(self, collection, doc_id, data):
+        """Like `set_document`, but keeps a stored document with a later 'timestamp'. Returns whether it wrote."""
+        with self._locked():
+            current = self.data.get(collection, {}).get(doc_id)
+            if current is not None and _timestamp_value(current.get('timestamp')) > _timestamp_value(data.get('timestamp')):
+                return False
+            self.set_document(collection, doc_id, data)
+        return True
+
+    def update_document(self, collection, doc_id, fields):
+        with self._locked():
+            doc = self.data.get(collection, {}).get(doc_id)
+            if doc is None:
+                return False
+            fields = self._externalize(fields)
+            doc.update(fields)
+            self._write({"op": "update", "c": collection, "id": doc_id, "fields": fields})
+        return True
+
     def get_document(self, collection, doc_id):
-        return self.data.get(collection, {}).get(doc_id)
+        with self._locked(exclusive=False):
+            data = self.data.get(collection, {}).get(doc_id)
+            return self._resolve(data) if data is not None else None
+
+    def increment_counters(self, deltas):
+        """Adds `deltas` ({scope: {field: delta}}) to the aggregate counters kept in the "stats" collection."""
+        if not deltas:
+            return
+        entries = [{"op": "inc", "c": "stats", "id": scope, "fields": fields} for scope, fields in deltas.items()]
+        with self._locked():
+            for entry in entries:
+                self._apply(entry)
+            self._write(*entries)
+
+    def get_counters(self, scope=None):
+        """Counters for one scope (None if it was never written), or {scope: counters} for all of them."""
+        with self._locked(exclusive=False):
+            stats = self.data.get("stats", {})
+            if scope is not None:
+                counters = stats.get(scope)
+                return dict(counters) if counters is not None else None
+            return {name: dict(counters) for name, counters in stats.items()}
+
+    def replace_counters(self, counters):
+        """Overwrites every counter scope with `counters` (used by a full recompute)."""
+        with self._locked():
+            stale = set(self.data.get("stats", {})) - set(counters)
+            entries = [{"op": "delete", "c": "stats", "id": scope} for scope in stale]
+            entries += [{"op": "put", "c": "stats", "id": scope, "doc": dict(fields)} for scope, fields in counters.items()]
+            for entry in entries:
+                self._apply(entry)
+            self._write(*entries)
+
+    @staticmethod
+    def _sort(results, order_by, descending):
+        if order_by:
+            # ISO timestamps sort correctly as strings
+            results.sort(key=lambda x: _sort_value(x.get(order_by)), reverse=descending)
+        return results
+
+    def query(self, collection, field, value, order_by=None, descending=False, limit=None, include_id=False):
+        with self._locked(exclusive=False):
+            matches = [(doc_id, data) for doc_id, data in self.data.get(collection, {}).items()
+                       if str(data.get(field)) == str(value)]
+        if order_by:
+            matches.sort(key=lambda item: _sort_value(item[1].get(order_by)), reverse=descending)
+        if limit:
+            matches = matches[:limit]
 
-    def query(self, collection, field, value):
+        # Only the documents actually returned are copied
         results = []
-        for doc_id, data in self.data.get(collection, {}).items():
-            if str(data.get(field)) == str(value):
+        for doc_id, data in matches:
+            res = self._resolve(data)
+            if include_id:
                 # Attach ID mostly for compatibility
-                res = data.copy()
-                # res['id'] = doc_id 
-                results.append(res)
+                res['id'] = doc_id
+            results.append(res)
         return results
     
-    def get_all(self, collection):
+    def page(self, collection, order_by, descending=True, limit=50, start_after=None, filters=None):
+        """
+        Returns up to `limit` documents (with 'id', without the BLOB_FIELDS texts) after the
+        document `start_after`, ordered by `order_by` then id, keeping only those matching
+        every `filters` field.
+
+        Every call filters and sorts the whole collection in memory, so deep pages of a large
+        collection cost the same as the first; LOCAL_DB_BACKEND=sqlite serves them from an index.
+        """
+        filters = filters or {}
+        with self._locked(exclusive=False):
+            items = [
+                (doc_id, data) for doc_id, data in self.data.get(collection, {}).items()
+                if all(str(data.get(f)) == str(v) for f, v in filters.items())
+            ]
+        items.sort(key=lambda item: (_sort_value(item[1].get(order_by)), item[0]), reverse=descending)
+
+        start = 0
+        if start_after:
+            for n, (doc_id, _) in enumerate(items):
+                if doc_id == start_after:
+                    start = n + 1
+                    break
+
+        # List views never show the long text fields, so they are left out rather than loaded
+        results = []
+        for doc_id, data in items[start:start + limit]:
+            res = {k: v for k, v in data.items() if k not in BLOB_FIELDS}
+            res['id'] = doc_id
+            results.append(res)
+        return results
+
+    def iter_documents(self, collection, fields, order_by=None, descending=False):
+        """Yields only `fields` of each document, one at a time, without copying whole documents."""
+        with self._locked(exclusive=False):
+            docs = self.data.get(collection, {})
+            keys = [(_sort_value(data.get(order_by)) if order_by else '', doc_id)
+                    for doc_id, data in docs.items()]
+        if order_by:
+            keys.sort(reverse=descending)
+        wanted_blobs = [f for f in fields if f in BLOB_FIELDS]
+        for _, doc_id in keys:
+            data = docs.get(doc_id)
+            if data is not None:
+                yield self._resolve({f: data.get(f) for f in fields}, wanted_blobs)
+
+    def get_all(self, collection, order_by=None, descending=False):
          results = []
-         for doc_id, data in self.data.get(collection, {}).items():
-             res = data.copy()
+         with self._locked(exclusive=False):
+             items = list(self.data.get(collection, {}).items())
+         for doc_id, data in items:
+             res = self._resolve(data)
              res['id'] = doc_id
              results.append(res)
-         return results
+         return self._sort(results, order_by, descending)
+
+# Firestore rejects WriteBatch commits with more than 500 operations
+FIRESTORE_BATCH_LIMIT = 500
+
+# Counter scope for platform-wide totals; each exam also gets an "exam_<exam_id>" scope
+STATS_ALL = "all"
+# Written only by a full recompute; until it exists the counters do not cover older results
+STATS_META = "meta"
+
+def _stats_scopes(exam_id):
+    return [STATS_ALL, f"exam_{exam_id}"] if exam_id else [STATS_ALL]
+
+def _status_field(status):
+    return "status_" + str(status).strip().lower().replace(' ', '_')
+
+def _score_value(score):
+    try:
+        return float(score)
+    except (TypeError, ValueError):
+        return 0.0
+
+def _result_deltas(docs):
+    """Counter increments ({scope: {field: delta}}) for a set of newly stored results."""
+    deltas = {}
+    for data in docs:
+        for scope in _stats_scopes(data.get('exam_id')):
+            counters = deltas.setdefault(scope, {})
+            for field, delta in (('total', 1),
+                                 ('passed', 1 if data.get('is_correct') else 0),
+                                 ('score_sum', _score_value(data.get('score'))),
+                                 (_status_field(data.get('status') or 'Graded'), 1)):
+                counters[field] = counters.get(field, 0) + delta
+    return deltas
+
+def _status_deltas(exam_id, old_status, new_status):
+    return {scope: {_status_field(old_status or 'Graded'): -1, _status_field(new_status): 1}
+            for scope in _stats_scopes(exam_id)}
+
+def _summarize(counters):
+    total = int(counters.get('total', 0))
+    passed = int(counters.get('passed', 0))
+    return {
+        'total': total,
+        'passed': passed,
+        'failed': total - passed,
+        'avg_score': counters.get('score_sum', 0) / total if total > 0 else 0,
+        'statuses': {field[len('status_'):]: int(value) for field, value in counters.items()
+                     if field.startswith('status_')}
+    }
 
 class FirebaseManager:
     def __init__(self, cred_path="serviceAccountKey.json"):
         self.connection_error = None
         self.mock_mode = False
         self.local_db = None
+        # Firestore stats counters are spread over this many shard docs to avoid write contention
+        self.stats_shards = int(os.environ.get("STATS_SHARDS", 10))
+        self._stats_initialized = False
+        # Exams and answer keys change only through save_exam, so reads are served from a TTL cache
+        self.exam_cache = ExamCache()
 
         # Check for environment variable first (Cloud Deployment)
         firebase_json = os.environ.get("FIREBASE_CREDENTIALS")
@@ -136,13 +613,13 @@ class FirebaseManager:
         print("Initializing Local Mock DB (Fallback Mode)...")
         self.mock_mode = True
         self.enabled = True # Enabled, but using mock
-        self.local_db = LocalDB()
-        print("Mock DB Ready. Data will be saved to 'local_db.json'.")
-
-    def save_result(self, student_answer, key_answer, score, is_correct, register_number, image_path=None):
-        if not self.enabled:
-            return None
+        if os.environ.get("LOCAL_DB_BACKEND", "json") == "sqlite":
+            self.local_db = SQLiteLocalDB()
+        else:
+            self.local_db = LocalDB()
+        print(f"Mock DB Ready. Data will be saved to '{self.local_db.db_file}'.")
 
+    def _result_doc(self, student_answer, key_answer, score, is_correct, register_number, image_path=None, exam_id=None, reasoning=None):
         # CLEANUP: Ensure register_number is a clean string
         reg_no_clean = str(register_number).strip()
 
@@ -156,21 +633,100 @@ class FirebaseManager:
             'image_path': image_path if image_path else "Not uploaded",
             'status': 'Graded'
         }
+        if exam_id:
+            data['exam_id'] = exam_id
+        if reasoning:
+            data['reasoning'] = reasoning
+        return data
+
+    def save_result(self, student_answer, key_answer, score, is_correct, register_number, image_path=None, exam_id=None, reasoning=None):
+        if not self.enabled:
+            return None
+
+        data = self._result_doc(student_answer, key_answer, score, is_correct, register_number, image_path, exam_id, reasoning)
+        reg_no_clean = data['register_number']
 
         if self.mock_mode:
             doc_id = self.local_db.add_document('graded_papers', data)
+            self._set_latest_pointer(reg_no_clean, doc_id, data['timestamp'])
+            self.local_db.increment_counters(_result_deltas([data]))
             print(f"DEBUG (MOCK): Saved result for {reg_no_clean} with ID {doc_id}")
             return doc_id
 
         try:
             doc_ref = self.db.collection('graded_papers').document()
-            doc_ref.set(data)
+
+            # Write the paper, its student's "latest result" pointer and the stats counters in one commit
+            @firestore.transactional
+            def save(transaction):
+                self._advance_latest_pointers(transaction, {reg_no_clean: (doc_ref.id, data['timestamp'])})
+                transaction.set(doc_ref, data)
+                self._add_stat_increments(transaction, _result_deltas([data]))
+
+            save(self.db.transaction())
             print(f"DEBUG: Saved result for Reg No: '{reg_no_clean}' with ID: {doc_ref.id}")
             return doc_ref.id
         except Exception as e:
             print(f"Error saving to Firestore: {e}")
             return None
 
+    def save_results_bulk(self, results):
+        """
+        Saves many results with as few round trips as possible.
+        `results` is a list of dicts holding `save_result`'s keyword arguments.
+        Returns the new doc ids in the same order (None where a write failed).
+        Firestore writes go out as transactions of at most 500 operations; a chunk whose
+        commit fails is retried one `save_result` at a time.
+        """
+        if not self.enabled or not results:
+            return [None] * len(results)
+
+        docs = [self._result_doc(**r) for r in results]
+
+        if self.mock_mode:
+            doc_ids = self.local_db.add_documents('graded_papers', docs)
+            latest = {}
+            for doc_id, data in zip(doc_ids, docs):
+                latest[data['register_number']] = (doc_id, data['timestamp'])
+            for reg_no_clean, (doc_id, timestamp) in latest.items():
+                self._set_latest_pointer(reg_no_clean, doc_id, timestamp)
+            self.local_db.increment_counters(_result_deltas(docs))
+            print(f"DEBUG (MOCK): Saved {len(doc_ids)} results in bulk")
+            return doc_ids
+
+        doc_ids = [None] * len(docs)
+        # Each result costs one write plus at most one pointer write; the rest is left for stats counters
+        chunk_size = (FIRESTORE_BATCH_LIMIT - 100) // 2
+        for start in range(0, len(docs), chunk_size):
+            chunk = docs[start:start + chunk_size]
+            try:
+                refs = []
+                latest = {}
+                for data in chunk:
+                    doc_ref = self.db.collection('graded_papers').document()
+                    refs.append(doc_ref)
+                    latest[data['register_number']] = (doc_ref.id, data['timestamp'])
+
+                @firestore.transactional
+                def save_chunk(transaction):
+                    self._advance_latest_pointers(transaction, latest)
+                    for doc_ref, data in zip(refs, chunk):
+                        transaction.set(doc_ref, data)
+                    self._add_stat_increments(transaction, _result_deltas(chunk))
+
+                save_chunk(self.db.transaction())
+                for n, doc_ref in enumerate(refs):
+                    doc_ids[start + n] = doc_ref.id
+                print(f"DEBUG: Saved {len(refs)} results in one batch commit")
+            except Exception as e:
+                # A failed commit writes nothing, so the chunk can be saved one result at a time
+                # rather than throwing away OCR and grading work that was already paid for
+                print(f"Error saving result batch to Firestore: {e}")
+                print("Attempting fallback: saving the batch's results individually...")
+                for n, r in enumerate(results[start:start + chunk_size]):
+                    doc_ids[start + n] = self.save_result(**r)
+        return doc_ids
+
     def get_result(self, doc_id):
         if not self.enabled: return None
         
@@ -186,22 +742,76 @@ class FirebaseManager:
             print(f"Error reading from Firestore: {e}")
             return None
 
-    def get_result_by_reg_no(self, register_number):
-        if not self.enabled: return None
+    @staticmethod
+    def _pointer_id(reg_no_clean):
+        # Firestore document ids cannot be empty or contain '/'
+        return reg_no_clean.replace('/', '_') if reg_no_clean else None
+
+    def _set_latest_pointer(self, reg_no_clean, doc_id, timestamp):
+        """Records `doc_id` as the newest result for a register number unless a later one is already recorded (mock mode)."""
+        pointer_id = self._pointer_id(reg_no_clean)
+        if pointer_id:
+            self.local_db.set_document_if_newer('latest_results', pointer_id, {'doc_id': doc_id, 'timestamp': timestamp})
+
+    def _advance_latest_pointers(self, transaction, latest):
+        """
+        Points each register number in `latest` ({reg_no: (doc_id, timestamp)}) at its doc, unless
+        the stored pointer is already later. Reads come first, so call this before any other write.
+        """
+        refs = {}
+        for reg_no_clean, entry in latest.items():
+            pointer_id = self._pointer_id(reg_no_clean)
+            if pointer_id:
+                refs[pointer_id] = (self.db.collection('latest_results').document(pointer_id), entry)
+        if not refs:
+            return
+        current = {snapshot.id: snapshot.to_dict()
+                   for snapshot in self.db.get_all([ref for ref, _ in refs.values()], transaction=transaction)
+                   if snapshot.exists}
+        for pointer_id, (ref, (doc_id, timestamp)) in refs.items():
+            stored = current.get(pointer_id)
+            if stored and _timestamp_value(stored.get('timestamp')) > _timestamp_value(timestamp):
+                continue
+            transaction.set(ref, {'doc_id': doc_id, 'timestamp': timestamp})
+
+    def get_latest_result_with_id(self, register_number):
+        """
+        Returns (doc_id, result) for a student's newest graded paper, or (None, None).
+        Reads the per-student "latest_results" pointer (two point reads); falls back to an
+        indexed query for papers saved before pointers existed and backfills the pointer.
+        """
+        if not self.enabled: return None, None
 
         reg_no_clean = str(register_number).strip()
+        pointer_id = self._pointer_id(reg_no_clean)
         print(f"DEBUG: Searching for Reg No: '{reg_no_clean}'")
 
         if self.mock_mode:
-            results = self.local_db.query('graded_papers', 'register_number', reg_no_clean)
+            pointer = self.local_db.get_document('latest_results', pointer_id) if pointer_id else None
+            if pointer:
+                result = self.local_db.get_document('graded_papers', pointer['doc_id'])
+                if result:
+                    return pointer['doc_id'], result
+
+            results = self.local_db.query('graded_papers', 'register_number', reg_no_clean,
+                                          order_by='timestamp', descending=True, limit=1, include_id=True)
             if results:
-                # Sort by timestamp decending (simple string compare for ISO format works well enough)
-                results.sort(key=lambda x: str(x.get('timestamp', '')), reverse=True)
-                return results[0]
+                result = results[0]
+                doc_id = result.pop('id')
+                self._set_latest_pointer(reg_no_clean, doc_id, result.get('timestamp'))
+                return doc_id, result
             print("DEBUG (MOCK): No results found.")
-            return None
+            return None, None
 
         try:
+            if pointer_id:
+                pointer = self.db.collection('latest_results').document(pointer_id).get()
+                if pointer.exists:
+                    doc_id = pointer.to_dict().get('doc_id')
+                    doc = self.db.collection('graded_papers').document(doc_id).get()
+                    if doc.exists:
+                        return doc.id, doc.to_dict()
+
             # Query the collection
             docs = self.db.collection('graded_papers')\
                 .where('register_number', '==', reg_no_clean)\
@@ -210,27 +820,35 @@ class FirebaseManager:
                 .stream()
             
             for doc in docs:
-                return doc.to_dict()
+                data = doc.to_dict()
+
+                @firestore.transactional
+                def backfill(transaction):
+                    self._advance_latest_pointers(transaction, {reg_no_clean: (doc.id, data.get('timestamp'))})
+
+                backfill(self.db.transaction())
+                return doc.id, data
             
-            return None
+            return None, None
         except Exception as e:
             print(f"Error searching Firestore: {e}")
             # Fallback
             try:
                  docs = self.db.collection('graded_papers').where('register_number', '==', reg_no_clean).limit(1).stream()
-                 for doc in docs: return doc.to_dict()
+                 for doc in docs: return doc.id, doc.to_dict()
             except: pass
-            return None
+            return None, None
+
+    def get_result_by_reg_no(self, register_number):
+        return self.get_latest_result_with_id(register_number)[1]
 
     def get_all_results(self):
         """Fetch all results across all students, sorted by newest first."""
         if not self.enabled: return []
 
         if self.mock_mode:
-            results = self.local_db.get_all('graded_papers')
             # Sort by timestamp descending
-            results.sort(key=lambda x: str(x.get('timestamp', '')), reverse=True)
-            return results
+            return self.local_db.get_all('graded_papers', order_by='timestamp', descending=True)
 
         try:
             docs = self.db.collection('graded_papers')\
@@ -259,28 +877,272 @@ class FirebaseManager:
                 return []
 
 
+    def get_results_page(self, limit=50, start_after=None, exam_id=None, status=None):
+        """
+        Fetch one page of results, newest first.
+        `start_after` is the cursor (doc id of the previous page's last result).
+        Returns (results, next_cursor); next_cursor is None on the last page,
+        and results is None if the page could not be read at all.
+        """
+        if not self.enabled: return [], None
+
+        filters = {}
+        if exam_id:
+            filters['exam_id'] = exam_id
+        if status:
+            filters['status'] = status
+
+        # Fetch one extra row to know whether another page exists
+        if self.mock_mode:
+            results = self.local_db.page('graded_papers', 'timestamp', descending=True, limit=limit + 1,
+                                         start_after=start_after, filters=filters)
+        else:
+            try:
+                query = self.db.collection('graded_papers')
+                for field, value in filters.items():
+                    query = query.where(field, '==', value)
+                query = query.order_by('timestamp', direction=firestore.Query.DESCENDING)
+                if start_after:
+                    cursor_doc = self.db.collection('graded_papers').document(start_after).get()
+                    if cursor_doc.exists:
+                        query = query.start_after(cursor_doc)
+                results = [{'id': doc.id, **doc.to_dict()} for doc in query.limit(limit + 1).stream()]
+            except Exception as e:
+                # Usually a missing composite index for the filter + ordering
+                print(f"Error fetching results page from Firestore: {e}")
+                print("Attempting fallback page scan without filters...")
+                results = self._scan_results_page(limit + 1, start_after, filters)
+                if results is None:
+                    return None, None
+
+        next_cursor = results[limit - 1]['id'] if len(results) > limit else None
+        return results[:limit], next_cursor
+
+    def _scan_results_page(self, limit, start_after, filters, batch_size=200):
+        """
+        Walks results newest first with only the timestamp ordering (which needs no composite
+        index), filtering in Python until `limit` matches are found. Returns None on failure.
+        """
+        try:
+            query = self.db.collection('graded_papers')\
+                .order_by('timestamp', direction=firestore.Query.DESCENDING)\
+                .limit(batch_size)
+            last_doc = None
+            if start_after:
+                cursor_doc = self.db.collection('graded_papers').document(start_after).get()
+                if cursor_doc.exists:
+                    last_doc = cursor_doc
+            results = []
+            while True:
+                page = query.start_after(last_doc) if last_doc else query
+                count = 0
+                for doc in page.stream():
+                    count += 1
+                    last_doc = doc
+                    data = doc.to_dict()
+                    if all(data.get(field) == value for field, value in filters.items()):
+                        results.append({'id': doc.id, **data})
+                        if len(results) >= limit:
+                            return results
+                if count < batch_size:
+                    return results
+        except Exception as e:
+            print(f"Fallback page scan failed: {e}")
+            return None
+
+    def iter_results(self, fields, batch_size=500, raise_errors=False):
+        """
+        Stream results newest first, fetching only `fields`.
+        Firestore reads use a field projection in pages of `batch_size`, so memory stays flat.
+        A read error ends the stream early unless `raise_errors` is set, in which case it propagates.
+        """
+        if not self.enabled: return
+
+        if self.mock_mode:
+            yield from self.local_db.iter_documents('graded_papers', fields, order_by='timestamp', descending=True)
+            return
+
+        try:
+            query = self.db.collection('graded_papers')\
+                .select(fields)\
+                .order_by('timestamp', direction=firestore.Query.DESCENDING)\
+                .limit(batch_size)
+            last_doc = None
+            while True:
+                page = query.start_after(last_doc) if last_doc else query
+                count = 0
+                for doc in page.stream():
+                    count += 1
+                    last_doc = doc
+                    yield doc.to_dict()
+                if count < batch_size:
+                    return
+        except Exception as e:
+            print(f"Error streaming results from Firestore: {e}")
+            if raise_errors:
+                raise
+
+    def set_feedback_audio(self, doc_id, audio_url):
+        """Records the URL of a result's pre-rendered feedback audio."""
+        if not self.enabled: return False
+
+        if self.mock_mode:
+            return self.local_db.update_document('graded_papers', doc_id, {'feedback_audio': audio_url})
+
+        try:
+            self.db.collection('graded_papers').document(doc_id).update({'feedback_audio': audio_url})
+            return True
+        except Exception as e:
+            print(f"Error saving feedback audio in Firestore: {e}")
+            return False
+
     def update_result_status(self, doc_id, new_status):
         """Update the status of a specific result (e.g., 'Pending Recorrection', 'Retest Requested')."""
         if not self.enabled: return False
         
         if self.mock_mode:
-            doc = self.get_result(doc_id)
-            if doc:
-                doc['status'] = new_status
-                self.local_db.add_document('graded_papers', doc) # Mock DB add_document acts like an upsert/re-save if ID exists, actually wait, local_db uses UUID. We should write a direct update.
-                self.local_db.data['graded_papers'][doc_id]['status'] = new_status
-                self.local_db.save()
-                return True
-            return False
+            current = self.local_db.get_document('graded_papers', doc_id)
+            if current is None:
+                return False
+            old_status = current.get('status')
+            if not self.local_db.update_document('graded_papers', doc_id, {'status': new_status}):
+                return False
+            if old_status != new_status:
+                self.local_db.increment_counters(_status_deltas(current.get('exam_id'), old_status, new_status))
+            return True
 
         try:
             doc_ref = self.db.collection('graded_papers').document(doc_id)
-            doc_ref.update({'status': new_status})
-            return True
+
+            # Read the old status and move the counters in the same transaction as the update
+            @firestore.transactional
+            def update(transaction):
+                snapshot = doc_ref.get(transaction=transaction)
+                if not snapshot.exists:
+                    return False
+                current = snapshot.to_dict()
+                transaction.update(doc_ref, {'status': new_status})
+                if current.get('status') != new_status:
+                    self._add_stat_increments(transaction, _status_deltas(current.get('exam_id'), current.get('status'), new_status))
+                return True
+
+            return update(self.db.transaction())
         except Exception as e:
             print(f"Error updating status in Firestore: {e}")
             return False
 
+    # --- STATISTICS ---
+    def _stats_shards_ref(self, scope):
+        return self.db.collection('stats').document(scope).collection('shards')
+
+    def _add_stat_increments(self, writer, deltas):
+        """Queues counter increments on a WriteBatch or Transaction, each scope on a random shard."""
+        for scope, fields in deltas.items():
+            shard = self._stats_shards_ref(scope).document(str(random.randrange(self.stats_shards)))
+            writer.set(shard, {field: firestore.Increment(delta) for field, delta in fields.items()}, merge=True)
+
+    def _read_counters(self, scope=None):
+        """Sums the counter shards of one scope (None if it has none), or of every scope as {scope: counters}."""
+        if scope is not None:
+            shards = list(self._stats_shards_ref(scope).stream())
+            if not shards:
+                return None
+            totals = {}
+            for shard in shards:
+                for field, value in shard.to_dict().items():
+                    totals[field] = totals.get(field, 0) + value
+            return totals
+
+        counters = {}
+        for shard in self.db.collection_group('shards').stream():
+            totals = counters.setdefault(shard.reference.parent.parent.id, {})
+            for field, value in shard.to_dict().items():
+                totals[field] = totals.get(field, 0) + value
+        return counters
+
+    def get_stats(self, exam_id=None):
+        """
+        Aggregate statistics (total, passed, failed, avg_score and per-status counts), platform-wide
+        or for one exam. Read from the incrementally maintained counters, so the cost does not grow
+        with the number of results. Counters are rebuilt once if they have never been computed.
+        """
+        if not self.enabled: return _summarize({})
+
+        scope = _stats_scopes(exam_id)[-1]
+        try:
+            self._ensure_stats()
+            counters = self.local_db.get_counters(scope) if self.mock_mode else self._read_counters(scope)
+            return _summarize(counters or {})
+        except Exception as e:
+            print(f"Error reading stats: {e}")
+            return _summarize({})
+
+    def get_exam_stats(self):
+        """Per-exam statistics as {exam_id: stats}."""
+        if not self.enabled: return {}
+
+        try:
+            self._ensure_stats()
+            counters = self.local_db.get_counters() if self.mock_mode else self._read_counters()
+        except Exception as e:
+            print(f"Error reading exam stats: {e}")
+            return {}
+        return {scope[len('exam_'):]: _summarize(fields) for scope, fields in counters.items()
+                if scope.startswith('exam_')}
+
+    def _ensure_stats(self):
+        """
+        Runs the one-time full recompute on a database whose counters were never initialized.
+        Increments from new saves alone would leave out every result stored before counters existed.
+        """
+        if self._stats_initialized:
+            return
+        marker = self.local_db.get_counters(STATS_META) if self.mock_mode else self._read_counters(STATS_META)
+        if marker:
+            self._stats_initialized = True
+        else:
+            self.recompute_stats()
+
+    def recompute_stats(self):
+        """
+        Rebuilds every stats counter with one full scan of the results and returns the new
+        counters. Increments that land while the scan runs can be lost, so run it when idle.
+        Returns None, leaving the stored counters and marker untouched, if the scan or write fails.
+        """
+        if not self.enabled: return {}
+
+        try:
+            counters = _result_deltas(self.iter_results(['score', 'is_correct', 'status', 'exam_id'],
+                                                        raise_errors=True))
+        except Exception as e:
+            # A partial scan would undercount for good once the marker is written
+            print(f"Error scanning results for stats: {e}")
+            return None
+        counters.setdefault(STATS_ALL, {}).setdefault('total', 0)
+        counters[STATS_META] = {'initialized': 1}
+
+        if self.mock_mode:
+            self.local_db.replace_counters(counters)
+        else:
+            try:
+                # Drop the old shards, then store each scope's totals in shard 0
+                ops = [('delete', shard.reference, None) for shard in self.db.collection_group('shards').stream()]
+                ops += [('set', self._stats_shards_ref(scope).document('0'), fields) for scope, fields in counters.items()]
+                for start in range(0, len(ops), FIRESTORE_BATCH_LIMIT):
+                    batch = self.db.batch()
+                    for op, ref, fields in ops[start:start + FIRESTORE_BATCH_LIMIT]:
+                        if op == 'delete':
+                            batch.delete(ref)
+                        else:
+                            batch.set(ref, fields)
+                    batch.commit()
+            except Exception as e:
+                print(f"Error recomputing stats in Firestore: {e}")
+                return None
+        self._stats_initialized = True
+        print(f"DEBUG: Recomputed stats for {len(counters)} scopes")
+        return counters
+
     # --- EXAM MANAGEMENT ---
     def save_exam(self, course_name, key_text):
         if not self.enabled: return None
@@ -291,7 +1153,9 @@ class FirebaseManager:
                 'answer_key': key_text.strip(),
                 'created_at': datetime.datetime.now()
             }
-            return self.local_db.add_document('exams', data)
+            exam_id = self.local_db.add_document('exams', data)
+            self.exam_cache.invalidate()
+            return exam_id
 
         try:
             doc_ref = self.db.collection('exams').document()
@@ -300,6 +1164,7 @@ class FirebaseManager:
                 'answer_key': key_text.strip(),
                 'created_at': datetime.datetime.now()
             })
+            self.exam_cache.invalidate()
             return doc_ref.id
         except Exception as e:
             print(f"Error saving exam: {e}")
@@ -307,23 +1172,25 @@ class FirebaseManager:
 
     def get_all_exams(self):
         if not self.enabled: return []
+        return self.exam_cache.get_or_load('exams', self._load_all_exams) or []
 
+    def _load_all_exams(self):
         if self.mock_mode:
-            exams = self.local_db.get_all('exams')
             # Sort by created_at descending
-            exams.sort(key=lambda x: str(x.get('created_at', '')), reverse=True)
-            return exams
+            return self.local_db.get_all('exams', order_by='created_at', descending=True)
 
         try:
             exams = self.db.collection('exams').order_by('created_at', direction=firestore.Query.DESCENDING).stream()
             return [{'id': doc.id, **doc.to_dict()} for doc in exams]
         except Exception as e:
             print(f"Error fetching exams: {e}")
-            return []
+            return None
     
     def get_exam_key(self, exam_id):
         if not self.enabled: return None
+        return self.exam_cache.get_or_load(f"key:{exam_id}", lambda: self._load_exam_key(exam_id))
 
+    def _load_exam_key(self, exam_id):
         if self.mock_mode:
             exam = self.local_db.get_document('exams', exam_id)
             return exam.get('answer_key') if exam else None
@@ -336,4 +1203,3 @@ class FirebaseManager:
         except Exception as e:
             print(f"Error fetching exam key: {e}")
             return None
-
@@ -1,33 +1,142 @@
 # Lazy import in __init__
 import sys
 import os
+import re
 import json
-import requests
+import threading
 from dotenv import load_dotenv
+from openrouter_client import get_client
+from grading_cache import GradingCache
 
 # Load env if available
 load_dotenv()
 
+# Bump whenever the grading prompt or scoring rules change so stale cached verdicts are ignored.
+PROMPT_VERSION = "v2"
+
+def _answer_terms(text):
+    """Lowercased words and numbers of an answer, ignoring punctuation and order."""
+    return set(re.findall(r"\d+(?:\.\d+)?|\w+", str(text or "").lower()))
+
 class Grader:
     def __init__(self, model_name='nvidia/nemotron-nano-12b-v2-vl:free'):
         self.model_name = model_name
-        self.api_key = os.environ.get("OPENROUTER_API_KEY")
-        self.site_url = os.environ.get("SITE_URL", "http://localhost")
-        self.app_name = os.environ.get("APP_NAME", "AI Grader")
+        self.client = get_client()
+        self.cache = GradingCache()
+        # Max answers packed into a single grade_batch request
+        self.batch_size = max(1, int(os.environ.get("GRADE_BATCH_SIZE", 10)))
+
+        # Local embedding tier (opt-in): clear matches / clear misses are scored without calling the LLM
+        self.embedding_enabled = os.environ.get("EMBEDDING_TIER", "0") == "1"
+        self.embedding_model_name = os.environ.get("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+        self.embed_high = float(os.environ.get("EMBEDDING_HIGH_THRESHOLD", 0.92))
+        self.embed_low = float(os.environ.get("EMBEDDING_LOW_THRESHOLD", 0.20))
+        self.embedding_model = None
+        self._model_lock = threading.Lock()
+        self._key_embeddings = {}
+        self.llm_calls_avoided = 0
         
-        if not self.api_key:
+        if not self.client.api_key:
             print("WARNING: OPENROUTER_API_KEY environment variable is not set. Grading will fail.")
         else:
             print(f"Grader initialized with OpenRouter ({self.model_name}).")
 
     def _load_model(self):
-        pass
+        """Loads the SentenceTransformer on first use; disables the tier if it is unavailable."""
+        if self.embedding_model is not None or not self.embedding_enabled:
+            return self.embedding_model
+
+        with self._model_lock:
+            if self.embedding_model is None and self.embedding_enabled:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                    print(f"Loading semantic model: {self.embedding_model_name}...")
+                    self.embedding_model = SentenceTransformer(self.embedding_model_name)
+                    print("Semantic model loaded.")
+                except Exception as e:
+                    print(f"WARNING: Embedding tier disabled ({e}). All answers will go to the LLM.")
+                    self.embedding_enabled = False
+        return self.embedding_model
+
+    def _fast_path(self, student_answer, key_answer):
+        """
+        Scores the answer locally when it is clearly right or clearly wrong.
+        Returns (raw_score, feedback), or None when the answer falls in the ambiguous band.
+        Full credit also needs the same words and numbers as the key: embeddings place
+        "the answer is 4" and "the answer is 5" almost on top of each other.
+        """
+        if not student_answer or not str(student_answer).strip():
+            with self._model_lock:
+                self.llm_calls_avoided += 1
+            return 0.0, "No answer text was found on the sheet."
+
+        model = self._load_model()
+        if model is None:
+            return None
+
+        try:
+            from sentence_transformers import util
+
+            key_embedding = self._key_embeddings.get(key_answer)
+            if key_embedding is None:
+                key_embedding = model.encode(key_answer, convert_to_tensor=True)
+                with self._model_lock:
+                    # Exams reuse one key across every paper; keep only a handful around
+                    if len(self._key_embeddings) >= 32:
+                        self._key_embeddings.clear()
+                    self._key_embeddings[key_answer] = key_embedding
+
+            student_embedding = model.encode(student_answer, convert_to_tensor=True)
+            similarity = float(util.cos_sim(student_embedding, key_embedding).item())
+        except Exception as e:
+            print(f"Embedding similarity failed, using LLM instead: {e}")
+            return None
+
+        if similarity >= self.embed_high and _answer_terms(student_answer) == _answer_terms(key_answer):
+            feedback = (f"The answer is nearly identical in meaning to the key (semantic similarity {similarity:.2f}), "
+                        "so it was awarded full credit without detailed review.")
+        elif similarity <= self.embed_low:
+            feedback = (f"The answer does not address the key answer (semantic similarity {similarity:.2f}). "
+                        "The expected content and final answer are missing.")
+        else:
+            return None
+
+        with self._model_lock:
+            self.llm_calls_avoided += 1
+        return max(0.0, min(1.0, similarity)), feedback
+
+    def stats(self):
+        """Counters for the cost-saving tiers in front of the LLM."""
+        return {
+            "llm_calls_avoided": self.llm_calls_avoided,
+            "embedding_tier": self.embedding_enabled,
+            "cache": self.cache.stats()
+        }
+
+    def _build_result(self, student_answer, key_answer, raw_score, feedback, threshold):
+        # NEW: Realistic Rules
+        # 1. 80% Rule (If 0.8 or above, award full 1.0 marks)
+        if raw_score >= 0.80:
+            final_score = 1.0
+        else:
+            final_score = raw_score
+
+        is_correct = final_score >= threshold
+        
+        return {
+            "student_answer": student_answer,
+            "key_answer": key_answer,
+            "similarity_score": round(final_score, 4),
+            "accuracy_raw": round(raw_score, 4),
+            "is_correct": is_correct,
+            "reasoning": feedback
+        }
 
     def grade_answer(self, student_answer, key_answer, threshold=0.5):
         """
         Compares the student's answer with the key answer using OpenRouter LLM.
         """
-        if not self.api_key:
+        if not self.client.api_key:
              return {
                 "student_answer": student_answer,
                 "key_answer": key_answer,
@@ -36,6 +145,15 @@ class Grader:
                 "error": "Missing OPENROUTER_API_KEY"
             }
 
+        cache_key = GradingCache.make_key(self.model_name, PROMPT_VERSION, student_answer, key_answer)
+        cached = self.cache.get(cache_key)
+        if cached:
+            return self._build_result(student_answer, key_answer, cached["score"], cached["feedback"], threshold)
+
+        fast = self._fast_path(student_answer, key_answer)
+        if fast:
+            return self._build_result(student_answer, key_answer, fast[0], fast[1], threshold)
+
         try:
             # Construct a prompt for semantic grading
             system_prompt = "You are a strict but fair teacher grading a student's handwritten answer."
@@ -57,13 +175,6 @@ class Grader:
             }}
             """
 
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "HTTP-Referer": self.site_url,
-                "X-Title": self.app_name,
-                "Content-Type": "application/json"
-            }
-            
             payload = {
                 "model": self.model_name,
                 "messages": [
@@ -72,12 +183,7 @@ class Grader:
                 ]
             }
 
-            response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                data=json.dumps(payload),
-                timeout=30
-            )
+            response = self.client.chat_completion(payload)
             
             if response.status_code != 200:
                 print(f"OpenRouter Error: {response.text}")
@@ -110,28 +216,13 @@ class Grader:
                 result_data = json.loads(content)
                 raw_score = float(result_data.get("score", 0.0))
                 feedback = result_data.get("feedback", "No detailed feedback provided.")
+                self.cache.put(cache_key, {"score": raw_score, "feedback": feedback})
             except json.JSONDecodeError:
                 print(f"JSON Parse Error. Raw: {content}")
                 raw_score = 0.0
                 feedback = "Failed to parse AI response."
 
-            # NEW: Realistic Rules
-            # 1. 80% Rule (If 0.8 or above, award full 1.0 marks)
-            if raw_score >= 0.80:
-                final_score = 1.0
-            else:
-                final_score = raw_score
-
-            is_correct = final_score >= threshold
-            
-            return {
-                "student_answer": student_answer,
-                "key_answer": key_answer,
-                "similarity_score": round(final_score, 4),
-                "accuracy_raw": round(raw_score, 4),
-                "is_correct": is_correct,
-                "reasoning": feedback
-            }
+            return self._build_result(student_answer, key_answer, raw_score, feedback, threshold)
 
         except Exception as e:
             print(f"Exception during grading: {e}")
@@ -144,6 +235,123 @@ class Grader:
                 "reasoning": "System Exception occurred."
             }
 
+    def grade_batch(self, student_answers, key_answer, threshold=0.5):
+        """
+        Grades several student answers against the same key.
+        Cache misses are packed into one OpenRouter request per chunk of `batch_size` answers;
+        any chunk whose reply cannot be parsed falls back to per-answer `grade_answer` calls.
+        Returns results in the same order and shape as `grade_answer`.
+        """
+        results = [None] * len(student_answers)
+        if not self.client.api_key:
+            return [self.grade_answer(ans, key_answer, threshold) for ans in student_answers]
+
+        # Identical answers (after normalization) are graded once and shared
+        pending = {}
+        for i, ans in enumerate(student_answers):
+            cache_key = GradingCache.make_key(self.model_name, PROMPT_VERSION, ans, key_answer)
+            if cache_key in pending:
+                pending[cache_key].append(i)
+                continue
+            cached = self.cache.get(cache_key)
+            fast = None if cached else self._fast_path(ans, key_answer)
+            if cached:
+                results[i] = self._build_result(ans, key_answer, cached["score"], cached["feedback"], threshold)
+            elif fast:
+                results[i] = self._build_result(ans, key_answer, fast[0], fast[1], threshold)
+            else:
+                pending[cache_key] = [i]
+
+        pending = list(pending.items())
+        for start in range(0, len(pending), self.batch_size):
+            chunk = pending[start:start + self.batch_size]
+            verdicts = self._grade_chunk([student_answers[idxs[0]] for _, idxs in chunk], key_answer)
+            for n, (cache_key, idxs) in enumerate(chunk):
+                if verdicts is None:
+                    single = self.grade_answer(student_answers[idxs[0]], key_answer, threshold)
+                    raw_score = single.get("accuracy_raw")
+                    feedback = single.get("reasoning")
+                    if raw_score is None:
+                        # Failed call: hand every copy the same error result
+                        for i in idxs:
+                            results[i] = dict(single, student_answer=student_answers[i])
+                        continue
+                else:
+                    raw_score, feedback = verdicts[n]
+                    self.cache.put(cache_key, {"score": raw_score, "feedback": feedback})
+                for i in idxs:
+                    results[i] = self._build_result(student_answers[i], key_answer, raw_score, feedback, threshold)
+
+        return results
+
+    def _grade_chunk(self, student_answers, key_answer):
+        """
+        Sends one multi-answer grading request.
+        Returns a list of (raw_score, feedback) tuples, or None if the reply is unusable.
+        """
+        if len(student_answers) == 1:
+            # Nothing to amortise; let the caller use the regular single-answer path
+            return None
+
+        answers_block = "\n".join(
+            f"            Answer {n + 1}: {json.dumps(ans)}" for n, ans in enumerate(student_answers)
+        )
+        try:
+            system_prompt = "You are a strict but fair teacher grading students' handwritten answers."
+            user_prompt = f"""
+            Target Key Answer: "{key_answer}"
+            Student Answers ({len(student_answers)} in total, graded independently):
+{answers_block}
+            
+            Task (apply to EACH student answer separately):
+            1. Compare the MEANING of the Student Answer to the Key Answer.
+            2. Ignore minor spelling/grammar mistakes.
+            3. CRITICAL: Check if the Final Answer/Conclusion is present and logically matches the Key's final outcome. If the final answer is missing or incorrect, deduct significant marks (maximum score should be 0.6).
+            4. If the core steps and meaning match perfectly or very closely, give a high score (0.8 - 1.0).
+            5. Provide a Raw Score between 0.0 and 1.0.
+            
+            Output format: JSON array ONLY, one object per answer in the same order. Do not use markdown blocks.
+            [
+                {{
+                    "score": <float 0.0-1.0>,
+                    "feedback": "<detailed 2-3 sentence explanation of what they got right, wrong, and if the final answer was present>"
+                }}
+            ]
+            """
+
+            payload = {
+                "model": self.model_name,
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ]
+            }
+
+            response = self.client.chat_completion(payload, timeout=self.client.timeout + 10 * len(student_answers))
+            if response.status_code != 200:
+                print(f"OpenRouter Batch Error: {response.text}")
+                return None
+
+            resp_json = response.json()
+            if 'choices' not in resp_json or len(resp_json['choices']) == 0:
+                return None
+
+            content = resp_json['choices'][0]['message']['content']
+            content = content.replace('```json', '').replace('```', '').strip()
+
+            items = json.loads(content)
+            if not isinstance(items, list) or len(items) != len(student_answers):
+                print(f"Batch grading returned {len(items) if isinstance(items, list) else 'non-list'} items for {len(student_answers)} answers. Falling back.")
+                return None
+
+            return [
+                (float(item.get("score", 0.0)), item.get("feedback", "No detailed feedback provided."))
+                for item in items
+            ]
+        except Exception as e:
+            print(f"Batch grading failed, falling back to single calls: {e}")
+            return None
+
 if __name__ == "__main__":
     grader = Grader()
     print("--- Test 1: Match ---")
@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+def normalize_text(text):
+    """Collapses whitespace so trivially different answers share a cache entry (case can matter)."""
+    return " ".join(str(text or "").split())
+
+class GradingCache:
+    """
+    Two-tier cache for LLM grading verdicts.
+    Tier 1 is an in-process LRU; tier 2 is a SQLite file shared by every worker on the host.
+    Entries are content-addressed on (model, prompt version, student answer, key answer).
+    The SQLite tier is also LRU: `created_at` is refreshed on every disk hit, and every
+    `TRIM_EVERY` writes the table is trimmed to the `max_disk_entries` most recently used rows.
+    """
+    TRIM_EVERY = 100
+
+    def __init__(self, db_path=None, max_entries=None, max_disk_entries=None):
+        self.db_path = db_path if db_path is not None else os.environ.get("GRADING_CACHE_PATH", "grading_cache.db")
+        self.max_entries = int(max_entries or os.environ.get("GRADING_CACHE_SIZE", 1024))
+        self.max_disk_entries = int(max_disk_entries or os.environ.get("GRADING_CACHE_DISK_SIZE", 100000))
+        self._writes = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS grading_cache ("
+                        "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+                    )
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_grading_cache_used ON grading_cache (created_at)")
+            except Exception as e:
+                print(f"WARNING: Grading cache disk tier disabled: {e}")
+                self.db_path = None
+
+    def _connect(self):
+        # One connection per thread (and per process, after a fork); `with conn:` only commits
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def make_key(model_name, prompt_version, student_answer, key_answer):
+        raw = "\x1f".join([
+            str(model_name),
+            str(prompt_version),
+            normalize_text(student_answer),
+            normalize_text(key_answer)
+        ])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self, key, value):
+        # Caller must hold self._lock
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return dict(self._memory[key])
+
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    row = conn.execute("SELECT value FROM grading_cache WHERE key = ?", (key,)).fetchone()
+                    if row:
+                        # Mark as recently used so trimming keeps it
+                        conn.execute("UPDATE grading_cache SET created_at = ? WHERE key = ?", (time.time(), key))
+                if row:
+                    value = json.loads(row[0])
+                    with self._lock:
+                        self._remember(key, value)
+                        self.disk_hits += 1
+                    return dict(value)
+            except Exception as e:
+                print(f"Grading cache read error: {e}")
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._remember(key, dict(value))
+
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO grading_cache (key, value, created_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(value), time.time())
+                    )
+            except Exception as e:
+                print(f"Grading cache write error: {e}")
+                return
+
+            with self._lock:
+                self._writes += 1
+                trim = self._writes % self.TRIM_EVERY == 0
+            if trim:
+                self._trim()
+
+    def _trim(self):
+        """Deletes the least recently used disk entries beyond `max_disk_entries`."""
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "DELETE FROM grading_cache WHERE key IN ("
+                    "SELECT key FROM grading_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,)
+                )
+        except Exception as e:
+            print(f"Grading cache trim error: {e}")
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "memory_entries": len(self._memory)
+            }
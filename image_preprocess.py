@@ -0,0 +1,60 @@
+import io
+import os
+
+def sniff_mime(image_bytes):
+    """Best-effort MIME type from the file signature (uploads are PNG or JPEG)."""
+    if image_bytes.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if image_bytes.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    if image_bytes[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "image/jpeg"
+
+class ImagePreprocessor:
+    """
+    Shrinks answer-sheet photos before they are sent to the vision model:
+    applies EXIF rotation, converts to grayscale, downscales to `max_dimension`
+    and re-encodes as JPEG, lowering quality until the payload fits `max_bytes`.
+    """
+    def __init__(self, enabled=None, max_dimension=None, quality=None, max_bytes=None, grayscale=None):
+        self.enabled = enabled if enabled is not None else os.environ.get("OCR_PREPROCESS", "1") == "1"
+        self.max_dimension = int(max_dimension or os.environ.get("OCR_MAX_DIMENSION", 2000))
+        self.quality = int(quality or os.environ.get("OCR_JPEG_QUALITY", 80))
+        self.max_bytes = int(max_bytes or os.environ.get("OCR_MAX_BYTES", 1500000))
+        self.grayscale = grayscale if grayscale is not None else os.environ.get("OCR_GRAYSCALE", "1") == "1"
+
+    def normalize(self, image_bytes):
+        """
+        Returns (image_bytes, mime_type). Falls back to the original bytes
+        (with their real MIME type) if preprocessing is off or Pillow cannot read the image.
+        """
+        if not self.enabled:
+            return image_bytes, sniff_mime(image_bytes)
+
+        try:
+            from PIL import Image, ImageOps
+
+            with Image.open(io.BytesIO(image_bytes)) as img:
+                img = ImageOps.exif_transpose(img)
+                img = img.convert("L") if self.grayscale else img.convert("RGB")
+                img.thumbnail((self.max_dimension, self.max_dimension))
+
+                quality = self.quality
+                while True:
+                    buf = io.BytesIO()
+                    img.save(buf, format="JPEG", quality=quality, optimize=True)
+                    data = buf.getvalue()
+                    if len(data) <= self.max_bytes or quality <= 40:
+                        break
+                    quality -= 10
+        except Exception as e:
+            print(f"WARNING: Image preprocessing skipped ({e}).")
+            return image_bytes, sniff_mime(image_bytes)
+
+        # Never make a payload bigger than the original upload
+        if len(data) >= len(image_bytes):
+            return image_bytes, sniff_mime(image_bytes)
+        return data, "image/jpeg"
@@ -0,0 +1,99 @@
+import os
+import copy
+import uuid
+import datetime
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+class JobQueue:
+    """
+    In-process queue for bulk grading jobs.
+    A job wraps one upload batch; a local pool runs it through the BatchPipeline while
+    per-paper progress is recorded so `/jobs/<id>` can report it as papers finish.
+    """
+    def __init__(self, pipeline, max_workers=None, max_history=None):
+        self.pipeline = pipeline
+        self.max_workers = int(max_workers or os.environ.get("JOB_WORKERS", 2))
+        self.max_history = int(max_history or os.environ.get("JOB_HISTORY", 100))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="grading-job")
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, papers, key_text, exam_id=None):
+        """Queues a batch of papers and returns the job id immediately."""
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'exam_id': exam_id,
+            'status': 'queued',
+            'created_at': datetime.datetime.now().isoformat(),
+            'finished_at': None,
+            'total': len(papers),
+            'done': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'papers': [
+                {'reg_no': p['reg_no'], 'filename': p['filename'], 'status': 'queued'}
+                for p in papers
+            ]
+        }
+
+        with self.lock:
+            self.jobs[job_id] = job
+            self._prune()
+
+        self.executor.submit(self._run, job_id, papers, key_text)
+        return job_id
+
+    def get(self, job_id):
+        """Returns a snapshot of the job, or None if it is unknown (or was pruned)."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return copy.deepcopy(job) if job else None
+
+    def _prune(self):
+        # Caller must hold self.lock. Drops the oldest finished jobs beyond max_history.
+        finished = [jid for jid, j in self.jobs.items() if j['status'] == 'completed']
+        for jid in finished[:max(0, len(finished) - self.max_history)]:
+            del self.jobs[jid]
+
+    def _run(self, job_id, papers, key_text):
+        with self.lock:
+            job = self.jobs[job_id]
+            job['status'] = 'running'
+
+        def on_start(index):
+            with self.lock:
+                job['papers'][index]['status'] = 'processing'
+
+        def on_result(index, outcome):
+            with self.lock:
+                paper = job['papers'][index]
+                job['done'] += 1
+                if outcome['ok']:
+                    job['succeeded'] += 1
+                    paper['status'] = 'done'
+                    paper['doc_id'] = outcome['doc_id']
+                    paper['score'] = outcome['result'].get('similarity_score', 0)
+                    paper['is_correct'] = outcome['result'].get('is_correct', False)
+                else:
+                    job['failed'] += 1
+                    paper['status'] = 'failed'
+                    paper['error'] = outcome['error']
+
+        try:
+            self.pipeline.run(papers, key_text, on_result=on_result, on_start=on_start)
+        except Exception as e:
+            print(f"Grading job {job_id} crashed: {e}")
+            with self.lock:
+                for paper in job['papers']:
+                    if paper['status'] in ('queued', 'processing'):
+                        paper['status'] = 'failed'
+                        paper['error'] = str(e)
+                        job['failed'] += 1
+                        job['done'] += 1
+        finally:
+            with self.lock:
+                job['status'] = 'completed'
+                job['finished_at'] = datetime.datetime.now().isoformat()
@@ -0,0 +1,107 @@
+import os
+import hashlib
+import threading
+
+class OCRCache:
+    """
+    Disk cache of OCR transcripts keyed on the SHA-256 of the image bytes plus the model settings.
+    Each entry is a small text file; the least recently used files are evicted once the
+    directory grows past `max_bytes`. Writes keep a running byte total (reset by each scan), so
+    the directory is only scanned, in the background, when that total goes over budget.
+    """
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or os.environ.get("OCR_CACHE_DIR", "ocr_cache")
+        self.max_bytes = int(max_bytes or os.environ.get("OCR_CACHE_MAX_BYTES", 50 * 1024 * 1024))
+        self._lock = threading.Lock()
+        # Bytes in the cache as of the last scan plus this process's writes since; None until scanned
+        self._total = None
+        self._evicting = False
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(image_bytes, model_name, model_type):
+        image_hash = hashlib.sha256(image_bytes).hexdigest()
+        return hashlib.sha256(f"{image_hash}|{model_name}|{model_type}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.txt")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            # Touch so eviction treats this entry as recently used
+            os.utime(path, None)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return text
+
+    def put(self, key, text):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            size = os.path.getsize(tmp_path)
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"OCR cache write error: {e}")
+            return
+
+        with self._lock:
+            if self._total is not None:
+                self._total += size - replaced
+            if self._evicting or (self._total is not None and self._total <= self.max_bytes):
+                return
+            self._evicting = True
+        threading.Thread(target=self._evict, daemon=True).start()
+
+    def _evict(self):
+        """
+        Scans the cache, deleting the least recently used files until it is back under 90% of
+        `max_bytes`, so the next scan waits for a tenth of the budget in new writes.
+        """
+        try:
+            entries = []
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".txt"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+                total += st.st_size
+
+            entries.sort()
+            target = self.max_bytes * 0.9 if total > self.max_bytes else self.max_bytes
+            for _, size, name in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                    total -= size
+                except OSError:
+                    pass
+            with self._lock:
+                self._total = total
+        finally:
+            with self._lock:
+                self._evicting = False
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
@@ -1,19 +1,29 @@
 import os
-import requests
 import base64
-import json
 from dotenv import load_dotenv
+from openrouter_client import get_client
+from ocr_cache import OCRCache
+from image_preprocess import ImagePreprocessor
 
 # Load env variables
 load_dotenv()
 
+class OCRFailure(str):
+    """
+    Error message returned by `process_image` in place of a transcript.
+    It is still a plain string for callers that print it, but lets the grading
+    pipeline tell a failed OCR apart from a student's answer.
+    """
+
 class OCREngine:
     def __init__(self):
-        self.api_key = os.environ.get("OPENROUTER_API_KEY")
-        self.site_url = os.environ.get("SITE_URL", "http://localhost")
-        self.app_name = os.environ.get("APP_NAME", "AI Grader")
+        self.client = get_client()
+        # Vision requests carry a whole page image, so they get longer than the client default
+        self.timeout = float(os.environ.get("OPENROUTER_OCR_TIMEOUT", 60))
+        self.cache = OCRCache()
+        self.preprocessor = ImagePreprocessor()
         
-        if not self.api_key:
+        if not self.client.api_key:
             print("WARNING: OPENROUTER_API_KEY environment variable is not set. OCR will fail.")
         else:
             print("OCR Engine initialized with OpenRouter.")
@@ -23,21 +33,46 @@ class OCREngine:
 
     def encode_image(self, image_path):
         with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+            return self.encode_bytes(image_file.read())
+
+    def encode_bytes(self, image_bytes):
+        return base64.b64encode(image_bytes).decode('utf-8')
 
-    def process_image(self, image_path, model_type="handwritten"):
+    def read_image(self, image):
+        """Returns the raw bytes of a path, a bytes object or a file-like object (e.g. a FileStorage stream)."""
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return bytes(image)
+        if hasattr(image, "read"):
+            if hasattr(image, "seek"):
+                image.seek(0)
+            return image.read()
+        with open(image, "rb") as image_file:
+            return image_file.read()
+
+    def process_image(self, image, model_type="handwritten"):
         """
         Performs OCR on an image using OpenRouter Vision Models.
+        `image` may be a file path, raw bytes or a file-like object.
         """
-        if not self.api_key:
-            return "Error: OPENROUTER_API_KEY not configured."
+        if not self.client.api_key:
+            return OCRFailure("Error: OPENROUTER_API_KEY not configured.")
 
-        if not os.path.exists(image_path):
-             return f"Error: Image file not found at {image_path}"
+        if isinstance(image, (str, os.PathLike)) and not os.path.exists(image):
+             return OCRFailure(f"Error: Image file not found at {image}")
 
         try:
-            # Prepare Image
-            base64_image = self.encode_image(image_path)
+            image_bytes = self.read_image(image)
+
+            # Identical sheets (e.g. re-uploads after fixing a roll number) are served from disk
+            cache_key = OCRCache.make_key(image_bytes, self.model_name, model_type)
+            cached_text = self.cache.get(cache_key)
+            if cached_text is not None:
+                print("SUCCESS: OCR text served from cache.")
+                return cached_text
+
+            # Prepare Image (rotate/grayscale/downscale so the payload stays small)
+            image_data, mime_type = self.preprocessor.normalize(image_bytes)
+            base64_image = self.encode_bytes(image_data)
             
             # Craft the prompt
             if model_type == "handwritten":
@@ -45,13 +80,6 @@ class OCREngine:
             else:
                 text_prompt = "Transcribe the printed text in this image exactly as it appears. output only the text."
 
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "HTTP-Referer": self.site_url,
-                "X-Title": self.app_name,
-                "Content-Type": "application/json"
-            }
-
             payload = {
                 "model": self.model_name,
                 "messages": [
@@ -65,7 +93,7 @@ class OCREngine:
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
+                                    "url": f"data:{mime_type};base64,{base64_image}"
                                 }
                             }
                         ]
@@ -74,30 +102,26 @@ class OCREngine:
             }
 
             print(f"DEBUG: sending OCR request to OpenRouter ({self.model_name})...")
-            response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                data=json.dumps(payload),
-                timeout=60
-            )
+            response = self.client.chat_completion(payload, timeout=self.timeout)
 
             if response.status_code != 200:
                 print(f"OCR API Error: {response.text}")
-                return f"Error: API returned {response.status_code} - {response.text}"
+                return OCRFailure(f"Error: API returned {response.status_code} - {response.text}")
 
             result = response.json()
             if 'choices' in result and len(result['choices']) > 0:
-                extracted_text = result['choices'][0]['message']['content']
+                extracted_text = result['choices'][0]['message']['content'].strip()
+                self.cache.put(cache_key, extracted_text)
                 print("SUCCESS: OCR text extracted.")
-                return extracted_text.strip()
+                return extracted_text
             else:
                 print(f"WARNING: Unexpected API response structure: {result}")
-                return "Error: No content in API response."
+                return OCRFailure("Error: No content in API response.")
 
         except Exception as e:
             error_msg = str(e)
             print(f"OCR Exception: {error_msg}")
-            return f"Error executing OCR: {error_msg}"
+            return OCRFailure(f"Error executing OCR: {error_msg}")
 
 if __name__ == "__main__":
     # Test block
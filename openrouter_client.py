@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import random
+import threading
+import email.utils
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+# Load env variables
+load_dotenv()
+
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+# Responses worth retrying: provider rate limiting and transient upstream failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """Client-side request limiter: `rate` tokens per second, bursts of up to `capacity`."""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class RetryBudget:
+    """Caps the total number of retries spent across one batch of papers."""
+    def __init__(self, max_retries):
+        self.remaining = max_retries
+        self.lock = threading.Lock()
+
+    def try_spend(self):
+        with self.lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+_local = threading.local()
+
+@contextmanager
+def use_retry_budget(budget):
+    """Makes every OpenRouter call on this thread draw retries from `budget`."""
+    previous = getattr(_local, "budget", None)
+    _local.budget = budget
+    try:
+        yield budget
+    finally:
+        _local.budget = previous
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class OpenRouterClient:
+    """
+    Shared HTTP client for OpenRouter chat completions.
+    Keeps a pooled keep-alive session so repeated calls reuse TCP/TLS connections.
+    """
+    def __init__(self, api_key=None, pool_size=None, timeout=None):
+        self.api_key = api_key if api_key is not None else os.environ.get("OPENROUTER_API_KEY")
+        self.site_url = os.environ.get("SITE_URL", "http://localhost")
+        self.app_name = os.environ.get("APP_NAME", "AI Grader")
+        self.pool_size = int(pool_size or os.environ.get("OPENROUTER_POOL_SIZE", 10))
+        self.timeout = float(timeout or os.environ.get("OPENROUTER_TIMEOUT", 30))
+
+        self.max_retries = int(os.environ.get("OPENROUTER_MAX_RETRIES", 4))
+        self.backoff_base = float(os.environ.get("OPENROUTER_BACKOFF_BASE", 1.0))
+        self.backoff_cap = float(os.environ.get("OPENROUTER_BACKOFF_CAP", 30.0))
+        # Outside a RetryBudget (request threads) retrying stops once the next attempt would start later
+        # than this many seconds after the first, keeping a call well inside gunicorn's 120s worker timeout
+        self.max_wait = float(os.environ.get("OPENROUTER_MAX_WAIT", 60.0))
+        # Free-tier models allow ~20 requests/minute; 0 disables client-side limiting
+        rate_per_min = float(os.environ.get("OPENROUTER_RATE_PER_MIN", 20))
+        self.limiter = TokenBucket(rate_per_min / 60.0, float(os.environ.get("OPENROUTER_BURST", 5)))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def headers(self, title=None):
+        """Single place where the OpenRouter request headers are built."""
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "HTTP-Referer": self.site_url,
+            "X-Title": title or self.app_name,
+            "Content-Type": "application/json"
+        }
+
+    def _backoff(self, attempt, retry_after=None, capped=True):
+        """
+        Seconds to sleep before the next attempt: full jitter, never earlier than the provider
+        asked us to wait. When `capped`, waits stay within `backoff_cap` and None is returned
+        if Retry-After asks for longer.
+        """
+        if capped and retry_after is not None and retry_after > self.backoff_cap:
+            return None
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+        if retry_after is None:
+            return delay
+        delay = max(delay, retry_after + random.uniform(0, self.backoff_base))
+        return min(delay, self.backoff_cap) if capped else delay
+
+    def chat_completion(self, payload, timeout=None, title=None, stream=False):
+        """
+        POSTs a chat completion payload and returns the raw `requests.Response`.
+        `timeout` overrides the client default for this call only. With `stream=True` the body
+        is not read up front (for `"stream": true` payloads); the caller must close the response.
+        Requests pass through the rate limiter; 429/5xx responses and connection errors are
+        retried with exponential backoff (honouring Retry-After) while retries and the
+        thread's RetryBudget last. Read timeouts are not retried, since the provider may still
+        be running (and billing) the first completion. Without a RetryBudget (request threads)
+        waits are capped at `backoff_cap` and no retry starts more than `max_wait` seconds after
+        the first attempt; background jobs with a budget wait as long as Retry-After asks.
+        The last response is returned, or the last error raised.
+        """
+        body = json.dumps(payload)
+        started = time.monotonic()
+        budget = getattr(_local, "budget", None)
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                response = self.session.post(
+                    OPENROUTER_URL,
+                    headers=self.headers(title),
+                    data=body,
+                    timeout=timeout or self.timeout,
+                    stream=stream
+                )
+                error = None
+            except requests.ReadTimeout:
+                raise
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response = None
+                error = e
+
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                return response
+
+            retry_after = parse_retry_after(response.headers.get("Retry-After")) if response is not None else None
+            capped = budget is None
+            delay = self._backoff(attempt, retry_after, capped) if attempt < self.max_retries else None
+            if capped and delay is not None and time.monotonic() - started + delay > self.max_wait:
+                delay = None
+            can_retry = delay is not None and (budget is None or budget.try_spend())
+            if not can_retry:
+                if error is not None:
+                    raise error
+                return response
+
+            if response is not None and stream:
+                # Hand the pooled connection back before retrying
+                response.close()
+            reason = error if error is not None else f"HTTP {response.status_code}"
+            print(f"OpenRouter call failed ({reason}). Retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})...")
+            time.sleep(delay)
+            attempt += 1
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Returns the process-wide OpenRouterClient, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenRouterClient()
+    return _client
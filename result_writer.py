@@ -0,0 +1,75 @@
+import os
+import time
+import threading
+from concurrent.futures import Future
+
+class BufferedResultWriter:
+    """
+    Collects graded results and saves them through `FirebaseManager.save_results_bulk`,
+    flushing when `max_items` results are waiting or the oldest has waited `max_delay` seconds.
+    `submit()` returns a Future that resolves to the saved doc id.
+    """
+    def __init__(self, firebase_mgr, max_items=None, max_delay=None):
+        self.firebase_mgr = firebase_mgr
+        self.max_items = int(max_items or os.environ.get("RESULT_WRITER_MAX_ITEMS", 100))
+        self.max_delay = float(max_delay or os.environ.get("RESULT_WRITER_MAX_DELAY", 2.0))
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="result-writer")
+        self._thread.start()
+
+    def submit(self, **result):
+        """Queues one result (`save_result` keyword arguments) for the next flush."""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("BufferedResultWriter is closed")
+            self._buffer.append((time.monotonic(), result, future))
+            if len(self._buffer) >= self.max_items:
+                self._cond.notify()
+            elif len(self._buffer) == 1:
+                # Wake the flusher so it starts timing the oldest entry
+                self._cond.notify()
+        return future
+
+    def close(self):
+        """Flushes everything still buffered and stops the background thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closed:
+                    self._cond.wait()
+                if not self._buffer and self._closed:
+                    return
+
+                deadline = self._buffer[0][0] + self.max_delay
+                while len(self._buffer) < self.max_items and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                items = self._buffer[:self.max_items]
+                self._buffer = self._buffer[self.max_items:]
+
+            self._flush(items)
+
+    def _flush(self, items):
+        try:
+            doc_ids = self.firebase_mgr.save_results_bulk([result for _, result, _ in items])
+        except Exception as e:
+            for _, _, future in items:
+                future.set_exception(e)
+            return
+
+        for (_, _, future), doc_id in zip(items, doc_ids):
+            if doc_id is None:
+                future.set_exception(RuntimeError("Failed to save result"))
+            else:
+                future.set_result(doc_id)
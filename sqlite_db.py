@@ -0,0 +1,285 @@
+import os
+import json
+import uuid
+import sqlite3
+import datetime
+import threading
+
+# Document fields copied into real columns so lookups and ordering can use an index
+INDEXED_FIELDS = ("register_number", "timestamp", "status", "exam_id")
+
+def _json_default(obj):
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return obj.isoformat()
+    return str(obj)
+
+def _column_value(value):
+    if value is None:
+        return None
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+class SQLiteLocalDB:
+    """
+    SQLite-backed drop-in for LocalDB (same add/get/query/get_all surface).
+    Documents are stored as JSON with the commonly filtered fields mirrored into indexed
+    columns, and the database runs in WAL mode so several readers (threads or gunicorn
+    workers) can work alongside a writer.
+    """
+    def __init__(self, db_file=None):
+        self.db_file = db_file or os.environ.get("LOCAL_DB_SQLITE_PATH", "local_db.sqlite3")
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "collection TEXT NOT NULL, id TEXT NOT NULL, data TEXT NOT NULL, "
+            "register_number TEXT, timestamp TEXT, status TEXT, exam_id TEXT, "
+            "PRIMARY KEY (collection, id))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_reg_no ON documents (collection, register_number, timestamp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_timestamp ON documents (collection, timestamp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_status ON documents (collection, status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_exam ON documents (collection, exam_id, timestamp)")
+        # Aggregate counters (admin statistics), one row per (scope, field)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS counters ("
+            "scope TEXT NOT NULL, field TEXT NOT NULL, value REAL NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (scope, field))"
+        )
+        conn.commit()
+
+    def _conn(self):
+        # One connection per thread (and per process, after a fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.db_file, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _field_sql(self, field):
+        if field in INDEXED_FIELDS:
+            return field, ()
+        return "json_extract(data, ?)", (f"$.{field}",)
+
+    def add_document(self, collection, data):
+        doc_id = str(uuid.uuid4())
+        if "timestamp" not in data and "created_at" not in data:
+             data["timestamp"] = datetime.datetime.now().isoformat()
+
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO documents (collection, id, data, register_number, timestamp, status, exam_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (collection, doc_id, json.dumps(data, default=_json_default),
+                 *(_column_value(data.get(f)) for f in INDEXED_FIELDS))
+            )
+        return doc_id
+
+    def add_documents(self, collection, docs):
+        """Inserts several documents in one transaction."""
+        doc_ids = []
+        rows = []
+        now = datetime.datetime.now().isoformat()
+        for data in docs:
+            doc_id = str(uuid.uuid4())
+            if "timestamp" not in data and "created_at" not in data:
+                data["timestamp"] = now
+            doc_ids.append(doc_id)
+            rows.append((collection, doc_id, json.dumps(data, default=_json_default),
+                         *(_column_value(data.get(f)) for f in INDEXED_FIELDS)))
+
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT INTO documents (collection, id, data, register_number, timestamp, status, exam_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        return doc_ids
+
+    def set_document(self, collection, doc_id, data):
+        """Creates or overwrites a document under a caller-chosen id."""
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO documents (collection, id, data, register_number, timestamp, status, exam_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (collection, doc_id, json.dumps(data, default=_json_default),
+                 *(_column_value(data.get(f)) for f in INDEXED_FIELDS))
+            )
+        return doc_id
+
+    def set_document_if_newer(self, collection, doc_id, data):
+        """Like `set_document`, but keeps a stored document with a later 'timestamp'. Returns whether it wrote."""
+        conn = self._conn()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO documents (collection, id, data, register_number, timestamp, status, exam_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (collection, id) DO UPDATE SET data = excluded.data, "
+                "register_number = excluded.register_number, timestamp = excluded.timestamp, "
+                "status = excluded.status, exam_id = excluded.exam_id "
+                "WHERE documents.timestamp IS NULL OR excluded.timestamp >= documents.timestamp",
+                (collection, doc_id, json.dumps(data, default=_json_default),
+                 *(_column_value(data.get(f)) for f in INDEXED_FIELDS))
+            )
+        return cursor.rowcount > 0
+
+    def update_document(self, collection, doc_id, fields):
+        conn = self._conn()
+        with conn:
+            row = conn.execute(
+                "SELECT data FROM documents WHERE collection = ? AND id = ?", (collection, doc_id)
+            ).fetchone()
+            if row is None:
+                return False
+            data = json.loads(row[0])
+            data.update(fields)
+            conn.execute(
+                "UPDATE documents SET data = ?, register_number = ?, timestamp = ?, status = ?, exam_id = ? "
+                "WHERE collection = ? AND id = ?",
+                (json.dumps(data, default=_json_default),
+                 *(_column_value(data.get(f)) for f in INDEXED_FIELDS), collection, doc_id)
+            )
+        return True
+
+    def get_document(self, collection, doc_id):
+        row = self._conn().execute(
+            "SELECT data FROM documents WHERE collection = ? AND id = ?", (collection, doc_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def increment_counters(self, deltas):
+        """Adds `deltas` ({scope: {field: delta}}) to the counters table in one transaction."""
+        rows = [(scope, field, delta) for scope, fields in deltas.items() for field, delta in fields.items()]
+        if not rows:
+            return
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT INTO counters (scope, field, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (scope, field) DO UPDATE SET value = value + excluded.value",
+                rows
+            )
+
+    def get_counters(self, scope=None):
+        """Counters for one scope (None if it was never written), or {scope: counters} for all of them."""
+        if scope is not None:
+            rows = self._conn().execute("SELECT field, value FROM counters WHERE scope = ?", (scope,)).fetchall()
+            return dict(rows) if rows else None
+        counters = {}
+        for name, field, value in self._conn().execute("SELECT scope, field, value FROM counters"):
+            counters.setdefault(name, {})[field] = value
+        return counters
+
+    def replace_counters(self, counters):
+        """Overwrites every counter scope with `counters` (used by a full recompute)."""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM counters")
+            conn.executemany(
+                "INSERT INTO counters (scope, field, value) VALUES (?, ?, ?)",
+                [(scope, field, value) for scope, fields in counters.items() for field, value in fields.items()]
+            )
+
+    def _select(self, collection, where="", params=(), order_by=None, descending=False, limit=None):
+        sql = "SELECT id, data FROM documents WHERE collection = ?" + where
+        params = (collection, *params)
+        if order_by:
+            order_sql, order_params = self._field_sql(order_by)
+            sql += f" ORDER BY {order_sql} {'DESC' if descending else 'ASC'}"
+            params += order_params
+        if limit:
+            sql += " LIMIT ?"
+            params += (int(limit),)
+        return self._conn().execute(sql, params).fetchall()
+
+    def query(self, collection, field, value, order_by=None, descending=False, limit=None, include_id=False):
+        field_sql, field_params = self._field_sql(field)
+        rows = self._select(collection, f" AND {field_sql} = ?", (*field_params, str(value)),
+                            order_by, descending, limit)
+        results = []
+        for doc_id, data in rows:
+            res = json.loads(data)
+            if include_id:
+                res['id'] = doc_id
+            results.append(res)
+        return results
+
+    def page(self, collection, order_by, descending=True, limit=50, start_after=None, filters=None):
+        """
+        Keyset pagination: up to `limit` documents (with 'id') after the document
+        `start_after`, ordered by `order_by` then id, filtered on exact field matches.
+        """
+        where = ""
+        params = ()
+        for field, value in (filters or {}).items():
+            field_sql, field_params = self._field_sql(field)
+            where += f" AND {field_sql} = ?"
+            params += (*field_params, str(value))
+
+        order_sql, order_params = self._field_sql(order_by)
+        if start_after:
+            row = self._conn().execute(
+                f"SELECT {order_sql} FROM documents WHERE collection = ? AND id = ?",
+                (*order_params, collection, start_after)
+            ).fetchone()
+            if row:
+                op = "<" if descending else ">"
+                where += f" AND ({order_sql} {op} ? OR ({order_sql} = ? AND id {op} ?))"
+                params += (*order_params, row[0], *order_params, row[0], start_after)
+
+        direction = "DESC" if descending else "ASC"
+        rows = self._conn().execute(
+            f"SELECT id, data FROM documents WHERE collection = ?{where} "
+            f"ORDER BY {order_sql} {direction}, id {direction} LIMIT ?",
+            (collection, *params, *order_params, int(limit))
+        ).fetchall()
+
+        results = []
+        for doc_id, data in rows:
+            res = json.loads(data)
+            res['id'] = doc_id
+            results.append(res)
+        return results
+
+    def iter_documents(self, collection, fields, order_by=None, descending=False):
+        """Yields only `fields` of each document, reading rows incrementally from a cursor."""
+        columns = []
+        params = []
+        for field in fields:
+            field_sql, field_params = self._field_sql(field)
+            columns.append(field_sql)
+            params.extend(field_params)
+        sql = f"SELECT {', '.join(columns)} FROM documents WHERE collection = ?"
+        params.append(collection)
+        if order_by:
+            order_sql, order_params = self._field_sql(order_by)
+            sql += f" ORDER BY {order_sql} {'DESC' if descending else 'ASC'}"
+            params.extend(order_params)
+
+        # A dedicated connection so a slow consumer never holds up other queries on this thread
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(500)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(fields, row))
+        finally:
+            conn.close()
+
+    def get_all(self, collection, order_by=None, descending=False):
+        results = []
+        for doc_id, data in self._select(collection, order_by=order_by, descending=descending):
+            res = json.loads(data)
+            res['id'] = doc_id
+            results.append(res)
+        return results
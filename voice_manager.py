@@ -1,52 +1,286 @@
 import asyncio
 import edge_tts
 import os
+import re
+import queue
 import uuid
+import hashlib
+import threading
+from concurrent.futures import Future
+
+def split_sentences(text):
+    """Splits text after sentence-ending punctuation so each sentence can be spoken on its own."""
+    return [part for part in re.split(r'(?<=[.!?])\s+', text.strip()) if part]
 
 class VoiceManager:
-    def __init__(self, output_dir="static/audio"):
+    """
+    Text-to-speech through edge-tts. Audio files are named after a hash of (voice, text),
+    so repeated texts reuse the existing file; once the directory grows past `max_bytes`
+    the least recently used files are evicted in the background.
+
+    All edge-tts work runs on one long-lived event loop thread. `submit()` schedules a
+    synthesis and returns a Future, and up to `concurrency` syntheses run at once.
+
+    Texts registered for streaming URLs live in `text_dir`, which must not be publicly served.
+    """
+    def __init__(self, output_dir="static/audio", max_bytes=None, concurrency=None, text_dir=None):
         self.output_dir = output_dir
         os.makedirs(self.output_dir, exist_ok=True)
+        self.text_dir = text_dir or os.environ.get("TTS_TEXT_DIR", "tts_texts")
+        os.makedirs(self.text_dir, exist_ok=True)
         # Default voice - English US
         self.voice = "en-US-AriaNeural"
+        self.max_bytes = int(max_bytes or os.environ.get("TTS_CACHE_MAX_BYTES", 100 * 1024 * 1024))
+        self.concurrency = int(concurrency or os.environ.get("TTS_CONCURRENCY", 4))
+        self.timeout = float(os.environ.get("TTS_TIMEOUT", 60))
+        self._lock = threading.Lock()
+        self._evicting = False
+        self._loop = None
+        self._loop_pid = None
+        self._semaphore = None
+        # Syntheses in flight by file name, so concurrent requests for the same text share one
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _audio_name(self, text):
+        return hashlib.sha256(f"{self.voice}|{text}".encode("utf-8")).hexdigest() + ".mp3"
+
+    def _url(self, filename):
+        return f"/{self.output_dir}/{filename}".replace("\\", "/")
+
+    def _event_loop(self):
+        """Returns the background event loop, starting its thread on first use (and after a fork)."""
+        with self._lock:
+            if self._loop is None or self._loop_pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, daemon=True, name="voice-loop").start()
+                self._loop = loop
+                self._loop_pid = os.getpid()
+                self._semaphore = None
+                self._pending = {}
+            return self._loop
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._event_loop())
+
+    async def _limit(self):
+        # Created on the loop thread, the only place it is used
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
 
     async def _generate_audio(self, text, output_path):
         """Async function to generate audio using edge-tts."""
         communicate = edge_tts.Communicate(text, self.voice)
         await communicate.save(output_path)
 
+    async def _render(self, text, filename):
+        output_path = os.path.join(self.output_dir, filename)
+        # Synthesize into a temp file so a half-written MP3 is never served under the real name
+        tmp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+        async with await self._limit():
+            try:
+                await self._generate_audio(text, tmp_path)
+                os.replace(tmp_path, output_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        self._schedule_eviction()
+        return self._url(filename)
+
+    def submit(self, text):
+        """
+        Schedules speech for `text` on the background loop and returns a
+        concurrent.futures.Future resolving to the audio URL. Cached audio resolves at once.
+        """
+        filename = self._audio_name(text)
+        output_path = os.path.join(self.output_dir, filename)
+
+        if os.path.exists(output_path):
+            try:
+                # Touch so eviction treats this file as recently used
+                os.utime(output_path, None)
+                with self._lock:
+                    self.hits += 1
+                future = Future()
+                future.set_result(self._url(filename))
+                return future
+            except OSError:
+                pass  # Evicted in the meantime; synthesize it again
+
+        loop = self._event_loop()
+        with self._lock:
+            self.misses += 1
+            future = self._pending.get(filename)
+            created = future is None
+            if created:
+                future = asyncio.run_coroutine_threadsafe(self._render(text, filename), loop)
+                self._pending[filename] = future
+        if created:
+            # Registered outside the lock: a future that has already finished runs the callback inline
+            future.add_done_callback(lambda done, name=filename: self._forget(name, done))
+        return future
+
+    def _forget(self, filename, future):
+        with self._lock:
+            if self._pending.get(filename) is future:
+                del self._pending[filename]
+
     def text_to_speech(self, text):
         """
         Generates TTS audio for the given text.
         Returns the relative path to the generated audio file.
         """
-        filename = f"{uuid.uuid4()}.mp3"
-        output_path = os.path.join(self.output_dir, filename)
-        
         try:
-            # edge-tts is async, so we need to run it in a loop
-            # Check if there is already a running loop (e.g. jupyter)
-            try:
-                loop = asyncio.get_event_loop()
-                if loop.is_running():
-                    # If we are in an async web server context (like some uvicorn setups), logic differs.
-                    # For standard Flask (sync), we create a new loop or use asyncio.run
-                    # But asyncio.run cannot be called when a loop is running.
-                    # Since Flask dev server is threaded/sync, asyncio.run usually works.
-                    # However, to be safe:
-                     asyncio.run(self._generate_audio(text, output_path))
-                else:
-                     loop.run_until_complete(self._generate_audio(text, output_path))
-            except RuntimeError:
-                # No event loop found
-                asyncio.run(self._generate_audio(text, output_path))
-            
-            return f"/{self.output_dir}/{filename}".replace("\\", "/")
-            
+            return self.submit(text).result(timeout=self.timeout)
         except Exception as e:
             print(f"TTS Generation Error: {e}")
             return None
 
+    def register_text(self, text):
+        """
+        Stores `text` in `text_dir` and returns its short speech id (the content hash),
+        so a streaming URL can name the text without carrying it in the query string.
+        """
+        speech_id = self._audio_name(text)[:-len(".mp3")]
+        path = os.path.join(self.text_dir, f"{speech_id}.txt")
+        if os.path.exists(path):
+            os.utime(path, None)
+            return speech_id
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+        self._schedule_eviction()
+        return speech_id
+
+    def registered_text(self, speech_id):
+        """The text registered under `speech_id`, or None if it is unknown or was evicted."""
+        if not re.fullmatch(r"[0-9a-f]{64}", speech_id or ""):
+            return None
+        try:
+            with open(os.path.join(self.text_dir, f"{speech_id}.txt"), "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def cached_audio_url(self, text):
+        """URL of already-synthesized audio for `text`, or None."""
+        filename = self._audio_name(text)
+        return self._url(filename) if os.path.exists(os.path.join(self.output_dir, filename)) else None
+
+    def stream_speech(self, text):
+        """
+        Yields MP3 bytes for `text` as edge-tts produces them, one sentence after another,
+        so playback can start after the first sentence instead of the whole reply.
+        The stream is also written to the audio cache once it completes.
+        """
+        output_path = os.path.join(self.output_dir, self._audio_name(text))
+        try:
+            with open(output_path, 'rb') as f:
+                os.utime(output_path, None)
+                with self._lock:
+                    self.hits += 1
+                while True:
+                    data = f.read(64 * 1024)
+                    if not data:
+                        return
+                    yield data
+        except OSError:
+            pass
+        with self._lock:
+            self.misses += 1
+
+        chunks = queue.Queue()
+        cancelled = threading.Event()
+
+        async def synthesize():
+            try:
+                async with await self._limit():
+                    for sentence in split_sentences(text):
+                        async for chunk in edge_tts.Communicate(sentence, self.voice).stream():
+                            if cancelled.is_set():
+                                return
+                            if chunk["type"] == "audio":
+                                chunks.put(chunk["data"])
+                chunks.put(None)
+            except Exception as e:
+                print(f"TTS Streaming Error: {e}")
+                chunks.put(e)
+
+        self._run(synthesize())
+
+        tmp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+        complete = False
+        try:
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    try:
+                        data = chunks.get(timeout=self.timeout)
+                    except queue.Empty:
+                        print("TTS Streaming Error: timed out waiting for audio")
+                        break
+                    if data is None:
+                        complete = True
+                        break
+                    if isinstance(data, Exception):
+                        break
+                    f.write(data)
+                    yield data
+        finally:
+            # Runs on success, on error and when the client disconnects mid-stream
+            cancelled.set()
+            if complete:
+                os.replace(tmp_path, output_path)
+                self._schedule_eviction()
+            elif os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _schedule_eviction(self):
+        with self._lock:
+            if self._evicting:
+                return
+            self._evicting = True
+        threading.Thread(target=self._evict, daemon=True).start()
+
+    def _evict(self):
+        """
+        Deletes the least recently used audio files and registered texts until together they
+        fit in `max_bytes`.
+        """
+        try:
+            entries = []
+            total = 0
+            for directory, suffix in ((self.output_dir, ".mp3"), (self.text_dir, ".txt")):
+                for name in os.listdir(directory):
+                    if not name.endswith(suffix):
+                        continue
+                    path = os.path.join(directory, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+                    total += st.st_size
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+        finally:
+            with self._lock:
+                self._evicting = False
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
 if __name__ == "__main__":
     # Test
     vm = VoiceManager()